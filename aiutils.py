@@ -1,33 +1,260 @@
-import os, json, subprocess, shutil
-from time import sleep
+import os, json
+from concurrent.futures import ThreadPoolExecutor
+import shlex
+import signal
 import subprocess
+import threading
 import time
+import uuid
 
 import openai
 
+from assistantcache import AssistantCache
+from context import ContextBuilder, heuristic_summary
+import metrics
+import tracing
 from github import GitHubApi
-
-
-def run_shell_command(command, cwd=None):
+import jobstore
+from repoindex import RepoIndexer
+from threadstore import ThreadStore
+from workspace import WorkspaceManager, mentioned_paths
+
+FINISHED_RUN_STATUSES = ("completed", "failed", "cancelled", "expired", "incomplete")
+
+# Messages sent inline with threads.create; any beyond this are added one by one
+MAX_THREAD_CREATE_MESSAGES = 32
+
+# Shell commands that only read files, and the flags that would make them write
+READ_ONLY_COMMANDS = {
+    "cat", "ls", "grep", "egrep", "fgrep", "rg", "find", "head", "tail", "wc",
+    "tree", "pwd", "file", "stat", "du", "diff", "echo", "sort", "uniq", "cut",
+    "nl", "basename", "dirname", "realpath", "true",
+}
+WRITE_FLAGS = {
+    "find": {
+        "-delete", "-exec", "-execdir", "-ok", "-okdir",
+        "-fprint", "-fprint0", "-fprintf", "-fls",
+    },
+    "sort": {"-o", "--output", "--compress-program"},
+    "tree": {"-o"},
+    "rg": {"--pre"},
+    "file": {"-C", "--compile"},
+}
+# Commands that write to their last operand when given more than one
+OUTPUT_OPERAND_COMMANDS = {"uniq"}
+
+
+def is_write_flag(program, token):
+    """
+    Checks one argument of program against its WRITE_FLAGS.
+
+    Long options match with or without =value and when abbreviated. Short
+    options also match inside a cluster or with their value attached, so
+    sort's -o catches -ofile and -uo. find's flags are whole words.
+    """
+    name = token.split("=")[0]
+    for flag in WRITE_FLAGS.get(program, ()):
+        if flag.startswith("--") or program == "find":
+            if name == flag or (len(name) > 2 and flag.startswith(name)):
+                return True
+        elif not token.startswith("--") and flag[1] in token[1:]:
+            return True
+    return False
+
+
+def is_read_only_command(command):
+    """
+    Checks whether a shell command only reads the workspace, so it can safely run
+    alongside other tool calls.
+
+    Every command in a pipeline or list must be on the READ_ONLY_COMMANDS list,
+    and there must be no output redirection (other than to /dev/null), command
+    substitution, line breaks, or flags or operands that make those commands
+    write.
+
+    Args:
+        command (str): The shell command.
+
+    Returns:
+        bool: True if the command is known to be read-only.
+    """
+    # shlex treats line breaks as whitespace, but the shell runs each line
+    if "`" in command or "$(" in command or "\n" in command or "\r" in command:
+        return False
+    try:
+        lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+        lexer.whitespace_split = True
+        tokens = list(lexer)
+    except ValueError:
+        return False
+
+    program = None
+    operands = 0
+    for i, token in enumerate(tokens):
+        if token in ("|", "||", "&&", ";"):
+            program = None
+            operands = 0
+        elif ">" in token:
+            if i + 1 >= len(tokens) or tokens[i + 1] != "/dev/null":
+                return False
+        elif "&" in token or "(" in token or ")" in token:
+            return False
+        elif program is None:
+            program = token
+            if program not in READ_ONLY_COMMANDS:
+                return False
+        elif token.startswith("-") and token != "-":
+            if is_write_flag(program, token):
+                return False
+        else:
+            operands += 1
+            if program in OUTPUT_OPERAND_COMMANDS and operands > 1:
+                return False
+    return True
+
+
+class CappedOutput:
+    def __init__(self, max_bytes):
+        """
+        Collects a stream of output but only keeps its first and last max_bytes / 2.
+
+        Args:
+            max_bytes (int): The most output to keep.
+        """
+        self.head_limit = max_bytes // 2
+        self.tail_limit = max_bytes - self.head_limit
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def read_from(self, pipe):
+        while True:
+            chunk = pipe.read1(65536)
+            if not chunk:
+                break
+            self.total += len(chunk)
+            room = self.head_limit - len(self.head)
+            if room > 0:
+                self.head += chunk[:room]
+                chunk = chunk[room:]
+            self.tail += chunk
+            if len(self.tail) > self.tail_limit:
+                del self.tail[: len(self.tail) - self.tail_limit]
+
+    def text(self):
+        head = self.head.decode("utf-8", errors="replace")
+        tail = self.tail.decode("utf-8", errors="replace")
+        omitted = self.total - len(self.head) - len(self.tail)
+        if omitted <= 0:
+            return head + tail
+        return f"{head}\n\n... [{omitted} bytes of output truncated] ...\n\n{tail}"
+
+
+def run_shell_command(command, cwd=None, timeout=120, max_bytes=65536):
+    """
+    Runs a shell command, streaming its output so memory stays bounded.
+
+    stderr is merged into stdout. Past max_bytes, only the start and end of the
+    output are kept, with a truncation marker between them. If the command runs
+    longer than timeout seconds, its whole process group is killed.
+
+    Args:
+        command (str): The shell command.
+        cwd (str, optional): The directory to run it in.
+        timeout (float): Seconds before the command is killed.
+        max_bytes (int): The most output to return.
+
+    Returns:
+        tuple: The exit code and the (possibly truncated) output.
+    """
     try:
-        result = subprocess.run(
-            command, cwd=cwd, shell=True, capture_output=True, text=True
+        proc = subprocess.Popen(
+            command,
+            cwd=cwd,
+            shell=True,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
         )
-        exit_code = result.returncode
-        stdout = result.stdout.strip()
-        return exit_code, stdout
     except Exception as e:
         return -1, str(e)
 
+    output = CappedOutput(max_bytes)
+    reader = threading.Thread(
+        target=output.read_from, args=(proc.stdout,), daemon=True
+    )
+    reader.start()
+
+    timed_out = False
+    try:
+        exit_code = proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        kill_process_group(proc)
+        exit_code = proc.wait()
+
+    # Background children can hold the pipe open after the shell exits
+    reader.join(timeout=1)
+    if reader.is_alive():
+        kill_process_group(proc)
+        reader.join()
+    proc.stdout.close()
+
+    outp = output.text()
+    if timed_out:
+        outp += f"\n[command killed after {timeout} seconds]"
+    return exit_code, outp.strip()
+
+
+def kill_process_group(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
 
 class llmUtils:
-    def __init__(self, config):
+    def __init__(self, config, git=None):
+        """
+        Answers issues with the OpenAI assistant. Nothing here touches the
+        network until the first issue comes in.
+
+        Args:
+            config (dict): The bot config.
+            git (GitHubApi, optional): The GitHub client to share, instead of
+                building another one.
+        """
         self.config = config
-        self.git = GitHubApi(config)
+        self.git = git or GitHubApi(config)
+        self.workspaces = WorkspaceManager(config)
+        self.indexer = None
+        if config.get("repo_index", True):
+            self.indexer = RepoIndexer(
+                os.path.join(self.workspaces.root, "index"),
+                max_chars=config.get("repo_index_chars", 6000),
+            )
+        self.threads = ThreadStore(config.get("state_db", "gort.db"))
+        self.summary_model = config.get("context_summary_model")
+        self.context = ContextBuilder(config, summarize=self.summarize_comment)
+        self.shell_limits = {
+            "timeout": config.get("shell_timeout", 120),
+            "max_bytes": config.get("shell_output_limit", 65536),
+        }
+        self.tool_pool = ThreadPoolExecutor(
+            max_workers=config.get("tool_workers", 4), thread_name_prefix="gort-tool"
+        )
+        self.fork_url = config.get(
+            "fork_url", "git@github.com:therattestman/{repo}.git"
+        )
         openai.api_key = config["ai_token"]
-        self.assistant = openai.beta.assistants.retrieve(config["ai_assistant_id"])
-        self.pending_tool_calls = 0  # Track pending tool requests
-        self.tool_lock = False  # Lock to prevent submitting new tool calls
+        if config.get("ai_base_url"):
+            openai.base_url = config["ai_base_url"]
+        self.assistants = AssistantCache(
+            config["ai_assistant_id"],
+            config.get("assistant_cache", "assistant.json"),
+            refresh=config.get("assistant_refresh", 3600),
+        )
         self.main_prompt = """
 You are a helpful junior developer named therattestman. You are working on a project with a coworker.
 
@@ -68,160 +295,539 @@ You should mention in your response that the PR has been created so the user kno
 
 """
 
-    def create_messages_from_comments(self, comments, title, body=None):
-
-        dialogue = [{"role": "user", "content": "Issue is titled: " + title}]
-        if body:
-            dialogue.append({"role": "user", "content": "Issue body: " + body})
+    @property
+    def assistant(self):
+        return self.assistants.get()
 
-        for comment in comments:
-            usern = comment["user"]["login"] if "user" in comment else "mystery"
-            role = "user" if usern != "therattestman" else "assistant"
-            body = comment["body"]
+    def create_messages_from_comments(self, comments, title, body=None):
+        return self.context.build(comments, title, body)
+
+    def messages_from_comments(self, comments):
+        return [self.context.message(comment) for comment in comments]
+
+    def summarize_comment(self, text):
+        """
+        Summarizes an older comment for a thread that's over its token budget.
+        Uses context_summary_model when it's set, and keeps the comment's first
+        sentences otherwise or if the model call fails.
+        """
+        if not self.summary_model:
+            return heuristic_summary(text)
+        try:
+            with tracing.span("summarize_comment"):
+                completion = openai.chat.completions.create(
+                    model=self.summary_model,
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": "Summarize this issue comment in one or two "
+                            "sentences. Keep file names, commands and error messages.",
+                        },
+                        {"role": "user", "content": self.context.trim(text)},
+                    ],
+                )
+        except openai.APIError as e:
+            print("Couldn't summarize a comment, keeping its first sentences:", e)
+            return heuristic_summary(text)
+        summary = (completion.choices[0].message.content or "").strip()
+        return summary or heuristic_summary(text)
+
+    @tracing.traced("process_tool_calls")
+    def process_tool_calls(self, tool_calls, repo_slug, workspace):
+        """
+        Runs the tool calls of one requires_action step.
+
+        Consecutive read-only shell calls run side by side in the tool pool.
+        Anything else (writefile, push, pr, or a shell command that might write)
+        waits for them and runs alone, in the order the assistant asked.
+
+        Returns:
+            list: One output per tool call, in the same order as tool_calls.
+        """
+        jobstore.update("awaiting_tools")
+        outputs = [None] * len(tool_calls)
+        batch = []
+
+        def flush():
+            futures = {}
+            for i in batch:
+                futures[i] = tracing.submit(
+                    self.tool_pool, self.run_tool_call, tool_calls[i], repo_slug, workspace
+                )
+            for i, future in futures.items():
+                outputs[i] = future.result()
+            batch.clear()
+
+        for i, thing in enumerate(tool_calls):
+            if self.is_parallel_safe(thing):
+                batch.append(i)
+            else:
+                flush()
+                outputs[i] = self.run_tool_call(thing, repo_slug, workspace)
+        flush()
+
+        jobstore.update("running")
+        return outputs
 
-            message = {"role": role, "content": body}
-            dialogue.append(message)
-        return dialogue
+    def is_parallel_safe(self, thing):
+        if "shell" not in thing.function.name:
+            return False
+        try:
+            command = json.loads(thing.function.arguments)["command"]
+        except (ValueError, KeyError, TypeError):
+            return False
+        return is_read_only_command(command)
 
-    def process_tool_calls(self, tool_calls, repo_slug):
-        outputs = []
+    def run_tool_call(self, thing, repo_slug, workspace):
         owner, repo = repo_slug.split("/")
-        for thing in tool_calls:
-            try:
-                arguments_json = thing.function.arguments
-                arguments_dict = json.loads(arguments_json)
-                name = thing.function.name
-                call_id = thing.id
-
-                print(f"Processing tool call with ID: {call_id}, Name: {name}")
-
-                # Simulate tool execution based on the tool name (e.g., shell, writefile)
-                if "shell" in name:
-                    command = arguments_dict["command"]
+        call_id = thing.id
+        start = time.time()
+        try:
+            arguments_json = thing.function.arguments
+            arguments_dict = json.loads(arguments_json)
+            name = thing.function.name
+
+            print(f"Processing tool call with ID: {call_id}, Name: {name}")
+
+            # Simulate tool execution based on the tool name (e.g., shell, writefile)
+            if "shell" in name:
+                command = arguments_dict["command"]
+                read_only = is_read_only_command(command)
+                cached = workspace.tool_cache.get(command) if read_only else None
+                if cached is not None:
+                    print(f"Reusing output of shell command: {command}")
+                    code, outp = cached
+                else:
                     print(f"Running shell command: {command}")
-                    code, outp = run_shell_command(command, cwd=repo)
-                    outputs.append(
-                        {
-                            "tool_call_id": call_id,
-                            "output": json.dumps({"exit_code": code, "stdout": outp}),
-                        }
-                    )
-                elif "writefile" in name:
-                    file_path = arguments_dict["path"]
-                    content = arguments_dict["content"]
-                    print(f"Writing to file: {file_path}")
-                    with open(repo + "/" + file_path, "w") as f:
-                        f.write(content)
-                    outputs.append(
-                        {
-                            "tool_call_id": call_id,
-                            "output": f"Successfully wrote to file: {file_path}",
-                        }
-                    )
-                elif "push" in name:
-                    commit_msg = arguments_dict["message"]
-                    print("Pushing changes to the repository")
-                    code, outp = run_shell_command(f"git add . && git commit -m '{commit_msg}' && git push", cwd=repo)
-                    outputs.append(
-                        {
-                            "tool_call_id": call_id,
-                            "output": json.dumps({"exit_code": code, "stdout": outp}),
-                        }
-                    )
-                elif "pr" in name:
-                    title = arguments_dict["title"]
-                    body = arguments_dict["body"]
-                    print("Creating a pull request")
-                    res = self.git.create_pull_request(owner, repo, title, body, "therattestman:main", "main")
-                    outputs.append(
-                        {
-                            "tool_call_id": call_id,
-                            "output": str(res),
-                        }
+                    with tracing.span("run_shell_command", command=command):
+                        code, outp = run_shell_command(
+                            command, cwd=workspace.path, **self.shell_limits
+                        )
+                    if read_only:
+                        workspace.tool_cache.put(command, (code, outp))
+                    else:
+                        # It may have changed files, so earlier reads are stale
+                        workspace.tool_cache.invalidate()
+                return {
+                    "tool_call_id": call_id,
+                    "output": json.dumps({"exit_code": code, "stdout": outp}),
+                }
+            elif "writefile" in name:
+                file_path = arguments_dict["path"]
+                content = arguments_dict["content"]
+                print(f"Writing to file: {file_path}")
+                root = os.path.realpath(workspace.path)
+                target = os.path.realpath(os.path.join(root, file_path))
+                if os.path.commonpath([root, target]) != root:
+                    return {
+                        "tool_call_id": call_id,
+                        "output": "Refusing to write outside the repository: "
+                        + file_path,
+                    }
+                workspace.tool_cache.invalidate()
+                with open(target, "w") as f:
+                    f.write(content)
+                return {
+                    "tool_call_id": call_id,
+                    "output": f"Successfully wrote to file: {file_path}",
+                }
+            elif "push" in name:
+                commit_msg = arguments_dict["message"]
+                print("Pushing changes to the repository")
+                workspace.tool_cache.invalidate()
+                push = f"git push origin HEAD:{workspace.branch}"
+                with tracing.span("run_shell_command", command=push):
+                    code, outp = run_shell_command(
+                        f"git add . && git commit -m '{commit_msg}' && {push}",
+                        cwd=workspace.path,
+                        **self.shell_limits,
                     )
-                # Track number of pending tool calls
-                self.pending_tool_calls += 1
-
-            except Exception as e:
-                outputs.append(
-                    {"tool_call_id": call_id, "output": f"An error occurred: {str(e)}"}
+                return {
+                    "tool_call_id": call_id,
+                    "output": json.dumps({"exit_code": code, "stdout": outp}),
+                }
+            elif "pr" in name:
+                title = arguments_dict["title"]
+                body = arguments_dict["body"]
+                print("Creating a pull request")
+                res = self.git.create_pull_request(
+                    owner, repo, title, body, f"therattestman:{workspace.branch}", "main"
                 )
-            finally:
-                # Decrease the pending tool count when done
-                self.pending_tool_calls -= 1
+                return {
+                    "tool_call_id": call_id,
+                    "output": str(res),
+                }
+            return {"tool_call_id": call_id, "output": f"Unknown tool: {name}"}
+
+        except Exception as e:
+            return {"tool_call_id": call_id, "output": f"An error occurred: {str(e)}"}
+        finally:
+            metrics.TOOL_SECONDS.labels(thing.function.name).observe(
+                time.time() - start
+            )
+            tracing.record(
+                f"tool.{thing.function.name}", start, time.time(), call_id=call_id
+            )
 
-        return outputs
+    def get_response(
+        self,
+        comments,
+        title,
+        body,
+        repo_slug,
+        provider=None,
+        issue_number=None,
+        delivery_id=None,
+    ):
+        """
+        Runs the assistant on an issue and returns its reply.
+
+        When provider and issue_number are given, the issue keeps one thread across
+        calls and only comments that aren't in it yet are added. Its changes are
+        pushed to a gort/issue-<number> branch on the fork. Each call works in its
+        own checkout, so issues in the same repo can be handled at the same time.
+
+        An issue's thread can only have one run at a time, so callers must not
+        run two jobs for one issue at once. Intake and JobStore.claim see to that.
+        """
+        with tracing.span("get_response"):
+            return self._get_response(
+                comments, title, body, repo_slug, provider, issue_number, delivery_id
+            )
 
-    def get_response(self, comments, title, body, repo_slug):
-        thread = openai.beta.threads.create()
-        msg = [{"role": "system", "content": self.main_prompt}]
-        msg += self.create_messages_from_comments(comments, title, body)
-        for item in msg:
-            openai.beta.threads.messages.create(
-                thread_id=thread.id, role="user", content=item["content"]
+    @tracing.traced("prepare_thread")
+    def prepare_thread(self, comments, title, body, repo_slug, provider, issue_number):
+        """
+        Finds or creates the issue's thread.
+
+        A new thread is created in one call with the whole conversation, and its
+        comments are marked synced straight away. For an existing thread, the
+        comments it doesn't have yet are returned so they can be sent along with
+        the run instead of one request each; run_thread marks them synced once
+        that run exists.
+
+        Returns:
+            tuple: The thread id, a list of messages to add when starting the run,
+            and the ids of the comments those messages cover.
+        """
+        start = time.perf_counter()
+        thread_id = None
+        if issue_number is not None:
+            thread_id = self.threads.get_thread(provider, repo_slug, issue_number)
+
+        if thread_id is not None:
+            synced = self.threads.synced_comments(thread_id)
+            new = [c for c in comments if c.get("id") not in synced]
+            new_ids = [c["id"] for c in new if "id" in c]
+            # Our own comments came from runs on this thread, so they're already in it
+            delta = [
+                m
+                for m in self.messages_from_comments(new)
+                if m["role"] != "assistant"
+            ]
+            print(f"Adding {len(delta)} new comments to thread {thread_id}")
+            metrics.THREAD_SETUP_SECONDS.labels("existing").observe(
+                time.perf_counter() - start
             )
+            return thread_id, delta, new_ids
 
-        run = openai.beta.threads.runs.create(
-            thread_id=thread.id, assistant_id=self.assistant.id
+        msg = self.create_messages_from_comments(comments, title, body)
+        thread = openai.beta.threads.create(
+            messages=msg[:MAX_THREAD_CREATE_MESSAGES]
         )
-        finished = False
+        for item in msg[MAX_THREAD_CREATE_MESSAGES:]:
+            openai.beta.threads.messages.create(
+                thread_id=thread.id, role=item["role"], content=item["content"]
+            )
+        if issue_number is not None:
+            # Before the thread is stored, so a later job never sends these again
+            self.threads.mark_synced(
+                thread.id, [c["id"] for c in comments if "id" in c]
+            )
+            self.threads.set_thread(provider, repo_slug, issue_number, thread.id)
+        metrics.THREAD_SETUP_SECONDS.labels("new").observe(time.perf_counter() - start)
+        return thread.id, [], []
 
+    def _get_response(
+        self, comments, title, body, repo_slug, provider, issue_number, delivery_id
+    ):
         owner, repo = repo_slug.split("/")
-        if not os.path.exists(repo):
-            repo_check = self.git.get_repo("therattestman", repo)
-            if (
-                "message" in repo_check
-                and "Not Found" in repo_check["message"]
-            ):
-                # need to fork
-                print("Forking repo")
-                self.git.fork_repo(owner, repo)
-
-            print(f"Cloning repo: {repo}")
-            print(
-                f"Target URL: git@github.com:therattestman/{repo}.git"
+        if issue_number is None:
+            job_id, branch = delivery_id, "main"
+        else:
+            job_id = f"issue{issue_number}-{delivery_id or uuid.uuid4().hex[:12]}"
+            branch = f"gort/issue-{issue_number}"
+
+        # A job that already started a run before a restart picks that run back
+        # up, in the worktree it left behind, since the run's edits are there
+        job = jobstore.current()
+        resume_run = job["run_id"] if job is not None and job["thread_id"] else None
+        if (
+            resume_run is not None
+            and not self.workspaces.has_worktree("therattestman", repo, job_id)
+            and self.cancel_run(job["thread_id"], resume_run)
+        ):
+            print(f"Workspace for run {resume_run} was gone, starting a new run")
+            resume_run = None
+        if resume_run is not None:
+            # Comments that came in since aren't in this run, so they stay
+            # unsynced for the issue's next job
+            thread_id, new_messages, new_ids = job["thread_id"], [], []
+            print(f"Resuming run {resume_run} on thread {thread_id}")
+        else:
+            thread_id, new_messages, new_ids = self.prepare_thread(
+                comments, title, body, repo_slug, provider, issue_number
+            )
+            jobstore.update(thread_id=thread_id, run_id=None)
+
+        repo_check = self.git.get_repo("therattestman", repo)
+        if "message" in repo_check and "Not Found" in repo_check["message"]:
+            # need to fork
+            print("Forking repo")
+            repo_check = self.git.fork_repo(owner, repo)
+
+        url = self.fork_url.format(repo=repo)
+        if resume_run is None and job is not None and job["state"] != "queued":
+            self.workspaces.discard("therattestman", repo, job_id)
+        jobstore.update("cloning")
+        paths = mentioned_paths([title, body] + [c.get("body") for c in comments])
+        strategy = self.workspaces.choose_strategy(
+            repo_slug, repo_check.get("size"), paths
+        )
+        with self.workspaces.checkout(
+            url,
+            "therattestman",
+            repo,
+            job_id=job_id,
+            branch=branch,
+            strategy=strategy,
+            paths=paths,
+            resume=resume_run is not None,
+        ) as workspace:
+            context = self.repo_context(repo, workspace)
+            try:
+                if resume_run is not None:
+                    jobstore.update("running")
+                    run = self.poll_run(thread_id, resume_run, repo_slug, workspace)
+                else:
+                    run = self.run_thread(
+                        thread_id, repo_slug, workspace, new_messages, context, new_ids
+                    )
+            except openai.NotFoundError:
+                if issue_number is None:
+                    raise
+                print(f"Thread {thread_id} is gone, starting a new one")
+                self.threads.forget_thread(provider, repo_slug, issue_number)
+                thread_id, new_messages, new_ids = self.prepare_thread(
+                    comments, title, body, repo_slug, provider, issue_number
+                )
+                jobstore.update(thread_id=thread_id, run_id=None)
+                run = self.run_thread(
+                    thread_id, repo_slug, workspace, new_messages, context
+                )
+            cache = workspace.tool_cache
+            print(f"Tool cache: {cache.hits} hits, {cache.misses} misses")
+
+        metrics.RUNS.labels(run.status).inc()
+        if run.status != "completed":
+            print(f"Run {run.id} ended with status {run.status}")
+            return "I'm sorry, I encountered an error."
+
+        try:
+            omessages = openai.beta.threads.messages.list(thread_id=thread_id, limit=1)
+            omessage = omessages.data[0]
+            raw_resp = omessage.content[0].text.value
+            return raw_resp
+        except Exception as e:
+            return "I'm sorry, I encountered an error.\n```" + str(e) + "```"
+
+    @tracing.traced("repo_index")
+    def repo_context(self, repo, workspace):
+        """
+        Returns:
+            str or None: An overview of the checked out repo for the run's
+            instructions, so the assistant doesn't have to explore it with ls/find,
+            and a note on what's missing if the checkout is sparse.
+        """
+        notes = []
+        if workspace.sparse_dirs is not None:
+            checked_out = ", ".join(workspace.sparse_dirs) or "no subdirectories"
+            notes.append(
+                "This is a sparse checkout: only top-level files and "
+                f"{checked_out} are present. Run `git sparse-checkout add <dir>` "
+                "to check out another directory."
             )
-            os.system(
-                f"git clone git@github.com:therattestman/{repo}.git"
+        if self.indexer is not None:
+            try:
+                notes.append(
+                    self.indexer.summary(
+                        repo, workspace.path, save=workspace.sparse_dirs is None
+                    )
+                )
+            except Exception as e:
+                print("Failed to index repo:", e)
+        return "\n".join(notes) or None
+
+    def run_params(self, thread_id, new_messages, context=None):
+        instructions = self.main_prompt
+        if context:
+            instructions += "\n" + context
+        params = {
+            "thread_id": thread_id,
+            "assistant_id": self.assistant.id,
+            # Added on top of the assistant's own instructions, for this run only
+            "additional_instructions": instructions,
+        }
+        if new_messages:
+            params["additional_messages"] = new_messages
+        return params
+
+    def run_thread(
+        self,
+        thread_id,
+        repo_slug,
+        workspace,
+        new_messages=None,
+        context=None,
+        comment_ids=None,
+    ):
+        """
+        Runs the assistant on a thread, answering tool calls, until the run ends.
+
+        Streams run events when ai_stream_runs is on (the default), so tool calls
+        are handled as soon as they're requested. Falls back to polling if the
+        backend refuses to stream.
+
+        Args:
+            new_messages (list, optional): Messages to add to the thread as the run starts.
+            context (str, optional): Extra instructions for this run, like the repo overview.
+            comment_ids (list, optional): The comments new_messages came from, marked
+                synced once the run that carries them is created.
+
+        Returns:
+            Run: The finished run.
+        """
+        params = self.run_params(thread_id, new_messages, context)
+        if self.config.get("ai_stream_runs", True):
+            try:
+                stream = openai.beta.threads.runs.create(**params, stream=True)
+            except openai.NotFoundError:
+                raise
+            except openai.APIStatusError as e:
+                print("Streaming runs unavailable, polling instead:", e)
+            else:
+                if comment_ids:
+                    self.threads.mark_synced(thread_id, comment_ids)
+                return self.stream_run(thread_id, stream, repo_slug, workspace)
+
+        run = openai.beta.threads.runs.create(**params)
+        if comment_ids:
+            self.threads.mark_synced(thread_id, comment_ids)
+        jobstore.update("running", run_id=run.id)
+        return self.poll_run(thread_id, run.id, repo_slug, workspace)
+
+    def stream_run(self, thread_id, stream, repo_slug, workspace):
+        run = None
+        while True:
+            action_run = None
+            waiting = time.time()
+            with stream:
+                for event in stream:
+                    if event.event == "thread.run.created":
+                        jobstore.update("running", run_id=event.data.id)
+                    if event.event.startswith("thread.run.") and (
+                        "step" not in event.event
+                    ):
+                        run = event.data
+                    if event.event == "thread.run.requires_action":
+                        action_run = event.data
+                        break
+                    if run is not None and run.status in FINISHED_RUN_STATUSES:
+                        self.record_wait("stream", waiting)
+                        return run
+            self.record_wait("stream", waiting)
+
+            if action_run is None:
+                if run is None:
+                    raise RuntimeError("Run stream ended before the run started")
+                # The stream dropped mid-run; pick the run back up by polling
+                print(f"Lost the event stream for run {run.id}, polling instead")
+                return self.poll_run(thread_id, run.id, repo_slug, workspace)
+
+            tool_calls = action_run.required_action.submit_tool_outputs.tool_calls
+            outputs = self.process_tool_calls(tool_calls, repo_slug, workspace)
+            stream = openai.beta.threads.runs.submit_tool_outputs(
+                thread_id=thread_id,
+                run_id=action_run.id,
+                tool_outputs=outputs,
+                stream=True,
             )
-        else:
-            os.system(f"cd {repo} && git pull")
 
-        while not finished:
-            run = openai.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
+    def cancel_run(self, thread_id, run_id):
+        """
+        Cancels a run and waits for it to stop, so the thread can take a new one.
+
+        Returns:
+            bool: False if the run had already ended (or is gone), so there was
+            nothing to cancel.
+        """
+        try:
+            run = openai.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+            if run.status in FINISHED_RUN_STATUSES:
+                return False
+            run = openai.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+        except openai.APIStatusError as e:
+            print(f"Could not cancel run {run_id}:", e)
+            return False
+        delay = self.config.get("ai_poll_min", 0.2)
+        while run.status not in FINISHED_RUN_STATUSES:
+            time.sleep(delay)
+            run = openai.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run_id)
+        return True
+
+    def record_wait(self, mode, since):
+        now = time.time()
+        metrics.RUN_WAIT_SECONDS.labels(mode).observe(now - since)
+        tracing.record("run_wait", since, now, mode=mode)
+
+    def poll_run(self, thread_id, run_id, repo_slug, workspace):
+        """
+        Polls a run until it ends, answering tool calls along the way.
+
+        The poll interval starts at ai_poll_min seconds and backs off up to
+        ai_poll_max while the run is busy, resetting after each tool call.
+
+        Returns:
+            Run: The finished run.
+        """
+        min_delay = self.config.get("ai_poll_min", 0.2)
+        max_delay = self.config.get("ai_poll_max", 5)
+        delay = min_delay
+        waiting = time.time()
+
+        while True:
+            with metrics.RUN_POLL_SECONDS.time(), tracing.span("runs.retrieve"):
+                run = openai.beta.threads.runs.retrieve(
+                    thread_id=thread_id, run_id=run_id
+                )
 
-            if run.status == "requires_action":
-                action = run.required_action
-                tool_calls = action.submit_tool_outputs.tool_calls
+            if run.status in FINISHED_RUN_STATUSES or run.status == "requires_action":
+                self.record_wait("poll", waiting)
 
-                if len(tool_calls) > 0:
-                    if not self.tool_lock:  # Only process if lock is released
-                        self.tool_lock = True  # Lock while processing tool calls
-                        outputs = self.process_tool_calls(tool_calls, repo_slug)
+            if run.status in FINISHED_RUN_STATUSES:
+                return run
 
-                        # Submit tool outputs
-                        openai.beta.threads.runs.submit_tool_outputs(
-                            thread_id=thread.id, run_id=run.id, tool_outputs=outputs
-                        )
+            if run.status == "requires_action":
+                tool_calls = run.required_action.submit_tool_outputs.tool_calls
+                outputs = self.process_tool_calls(tool_calls, repo_slug, workspace)
+
+                # Submit tool outputs
+                openai.beta.threads.runs.submit_tool_outputs(
+                    thread_id=thread_id, run_id=run_id, tool_outputs=outputs
+                )
+                delay = min_delay
+                waiting = time.time()
+                continue
 
-                        # Unlock when all pending tool calls are done
-                        if self.pending_tool_calls == 0:
-                            self.tool_lock = False
-
-            elif run.status == "completed":
-                finished = True
-                shutil.rmtree(repo)
-                try:
-                    omessages = openai.beta.threads.messages.list(thread_id=thread.id)
-                    omessage = omessages.data[0]
-                    raw_resp = omessage.content[0].text.value
-                    return raw_resp
-                except Exception as e:
-                    return "I'm sorry, I encountered an error.\n```" + str(e) + "```"
-
-            elif run.status == "failed":
-                finished = True
-                shutil.rmtree(repo)
-                return "I'm sorry, I encountered an error."
-
-            time.sleep(1)  # Exponential backoff could also be applied here
+            time.sleep(delay)
+            delay = min(delay * 1.5, max_delay)
@@ -0,0 +1,83 @@
+# stdlib
+import json
+import os
+import threading
+import time
+
+# pip
+import openai
+from openai.types.beta import Assistant
+
+
+class AssistantCache:
+    def __init__(self, assistant_id, path, refresh=3600):
+        """
+        Keeps the assistant's metadata in a local file so starting up doesn't
+        need the OpenAI API.
+
+        The file is read on first use and refetched once it's older than refresh
+        seconds. If refetching fails, the stale copy is used.
+
+        Args:
+            assistant_id (str): The assistant to look up.
+            path (str): The JSON file to keep it in.
+            refresh (float): How long the cached copy is good for, in seconds.
+        """
+        self.assistant_id = assistant_id
+        self.path = path
+        self.refresh = refresh
+        self.assistant = None
+        self.fetched_at = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        """
+        Returns:
+            Assistant: The assistant, from memory, the file, or the API.
+        """
+        with self.lock:
+            if self.assistant is None:
+                self.load()
+            if (
+                self.assistant is not None
+                and time.time() - self.fetched_at < self.refresh
+            ):
+                return self.assistant
+
+            try:
+                assistant = openai.beta.assistants.retrieve(self.assistant_id)
+            except openai.APIError as e:
+                if self.assistant is None:
+                    raise
+                print("Couldn't refresh the assistant, using the cached copy:", e)
+                return self.assistant
+
+            self.assistant = assistant
+            self.fetched_at = time.time()
+            self.save()
+            return assistant
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return
+        if cached.get("assistant", {}).get("id") != self.assistant_id:
+            return
+        self.assistant = Assistant.construct(**cached["assistant"])
+        self.fetched_at = cached["fetched_at"]
+
+    def save(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(
+                {
+                    "fetched_at": self.fetched_at,
+                    "assistant": self.assistant.model_dump(mode="json"),
+                },
+                f,
+            )
+        os.replace(tmp, self.path)
@@ -0,0 +1,373 @@
+# stdlib
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, routes, latency=0.0):
+        """
+        A local HTTP server that answers requests from a list of routes.
+
+        Args:
+            routes (list): (method, regex, handler) tuples. Handlers are called with
+                the request body (parsed JSON, or None) and the regex groups, and
+                return (status, JSON body), or (status, None, events) to stream
+                events as server-sent events.
+            latency (float): Seconds to wait before answering each request.
+        """
+        super().__init__(("127.0.0.1", 0), FakeHandler)
+        self.routes = [(m, re.compile(p), h) for m, p, h in routes]
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections when gort stops isn't worth a traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle_any(self, method):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            body = json.loads(raw) if raw else None
+        except ValueError:
+            body = None
+
+        path = self.path.split("?")[0]
+        for route_method, pattern, handler in server.routes:
+            match = pattern.fullmatch(path)
+            if route_method == method and match:
+                result = handler(body, *match.groups())
+                break
+        else:
+            result = (404, {"message": "Not Found"})
+
+        if len(result) == 3:
+            self.send_events(result[0], result[2])
+        else:
+            self.send_json(*result)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_events(self, status, events):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for event, data in events:
+            payload = data if isinstance(data, str) else json.dumps(data)
+            self.wfile.write(f"event: {event}\ndata: {payload}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+    def do_GET(self):
+        self.handle_any("GET")
+
+    def do_POST(self):
+        self.handle_any("POST")
+
+    def do_PATCH(self):
+        self.handle_any("PATCH")
+
+
+class FakeForge:
+    def __init__(self, bot_username, latency=0.0):
+        """
+        Stands in for the parts of the GitHub and Gitea REST APIs that gort uses
+        while answering an issue: listing and posting comments, looking up and
+        forking repos, and opening pull requests.
+
+        Args:
+            bot_username (str): Comments posted through the API are attributed to this user.
+            latency (float): Seconds added to every response.
+        """
+        self.bot_username = bot_username
+        self.comments = {}
+        self.posted = []
+        self.next_id = 1
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+
+        # Gitea's routes live under /api/v1
+        repo = r"(?:/api/v1)?/repos/([^/]+)/([^/]+)"
+        self.server = FakeServer(
+            [
+                ("GET", rf"{repo}/issues/(\d+)/comments", self.list_comments),
+                ("POST", rf"{repo}/issues/(\d+)/comments", self.post_comment),
+                ("GET", repo, self.get_repo),
+                ("POST", rf"{repo}/forks", self.get_repo),
+                ("POST", rf"{repo}/pulls", self.create_pull),
+            ],
+            latency=latency,
+        )
+
+    def start(self):
+        self.server.start()
+        return self
+
+    @property
+    def url(self):
+        return self.server.url
+
+    def add_comment(self, owner, repo, number, login, body):
+        """
+        Adds a comment to an issue, as if a user wrote it, and returns it.
+        """
+        with self.lock:
+            comment = {
+                "id": self.next_id,
+                "body": body,
+                "user": {"login": login},
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            }
+            self.next_id += 1
+            self.comments.setdefault((owner, repo, int(number)), []).append(comment)
+            if login == self.bot_username:
+                self.posted.append((time.time(), (owner, repo, int(number))))
+            self.changed.notify_all()
+            return comment
+
+    def list_comments(self, body, owner, repo, number):
+        with self.lock:
+            return 200, list(self.comments.get((owner, repo, int(number)), []))
+
+    def post_comment(self, body, owner, repo, number):
+        comment = self.add_comment(
+            owner, repo, number, self.bot_username, (body or {}).get("body", "")
+        )
+        return 201, comment
+
+    def get_repo(self, body, owner, repo):
+        return 200, {"name": repo, "owner": {"login": owner}, "size": 1}
+
+    def create_pull(self, body, owner, repo):
+        return 201, {"number": 1, "title": (body or {}).get("title")}
+
+    def answered(self, key):
+        """
+        Returns:
+            bool: True if the last comment on the issue is the bot's.
+        """
+        comments = self.comments.get(key)
+        return bool(comments) and comments[-1]["user"]["login"] == self.bot_username
+
+
+class FakeAssistants:
+    def __init__(self, script, latency=0.0, run_latency=0.5):
+        """
+        Stands in for the Assistants threads and runs API.
+
+        Every run plays the same script: each step is a list of tool calls the run
+        asks for (as {"name": ..., "arguments": {...}}), after which the run
+        completes with a canned reply. Runs can be polled or streamed.
+
+        Args:
+            script (list): The steps of tool calls for each run.
+            latency (float): Seconds added to every response.
+            run_latency (float): How long the "model" thinks before each step.
+        """
+        self.script = script
+        self.run_latency = run_latency
+        self.threads = {}
+        self.runs = {}
+        self.lock = threading.Lock()
+
+        thread = r"/threads/([^/]+)"
+        run = rf"{thread}/runs/([^/]+)"
+        self.server = FakeServer(
+            [
+                ("GET", r"/assistants/([^/]+)", self.get_assistant),
+                ("POST", r"/threads", self.create_thread),
+                ("POST", rf"{thread}/messages", self.create_message),
+                ("GET", rf"{thread}/messages", self.list_messages),
+                ("POST", rf"{thread}/runs", self.create_run),
+                ("GET", run, self.get_run),
+                ("POST", rf"{run}/submit_tool_outputs", self.submit_tool_outputs),
+                ("POST", rf"{run}/cancel", self.cancel_run),
+            ],
+            latency=latency,
+        )
+
+    def start(self):
+        self.server.start()
+        return self
+
+    @property
+    def url(self):
+        return self.server.url
+
+    def get_assistant(self, body, assistant_id):
+        return 200, {
+            "id": assistant_id,
+            "object": "assistant",
+            "created_at": int(time.time()),
+            "model": "fake",
+            "tools": [],
+        }
+
+    def create_thread(self, body):
+        thread_id = f"thread_{uuid.uuid4().hex}"
+        with self.lock:
+            self.threads[thread_id] = list((body or {}).get("messages", []))
+        return 200, {
+            "id": thread_id,
+            "object": "thread",
+            "created_at": int(time.time()),
+            "metadata": {},
+        }
+
+    def message(self, thread_id, role, text):
+        return {
+            "id": f"msg_{uuid.uuid4().hex}",
+            "object": "thread.message",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "role": role,
+            "status": "completed",
+            "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+            "attachments": [],
+            "metadata": {},
+        }
+
+    def create_message(self, body, thread_id):
+        with self.lock:
+            if thread_id not in self.threads:
+                return 404, {"error": {"message": "No thread found"}}
+            self.threads[thread_id].append(body)
+        return 200, self.message(thread_id, body["role"], str(body["content"]))
+
+    def list_messages(self, body, thread_id):
+        reply = self.message(thread_id, "assistant", "Here's what I found.")
+        return 200, {
+            "object": "list",
+            "data": [reply],
+            "first_id": reply["id"],
+            "last_id": reply["id"],
+            "has_more": False,
+        }
+
+    def create_run(self, body, thread_id):
+        with self.lock:
+            if thread_id not in self.threads:
+                return 404, {"error": {"message": "No thread found"}}
+            self.threads[thread_id].extend(body.get("additional_messages") or [])
+            run = {
+                "id": f"run_{uuid.uuid4().hex}",
+                "thread_id": thread_id,
+                "assistant_id": body["assistant_id"],
+                "step": 0,
+                "ready_at": time.time() + self.run_latency,
+            }
+            self.runs[run["id"]] = run
+        return self.respond(run, body.get("stream"), "thread.run.created")
+
+    def get_run(self, body, thread_id, run_id):
+        with self.lock:
+            run = self.runs.get(run_id)
+        if run is None:
+            return 404, {"error": {"message": "No run found"}}
+        return 200, self.run_object(run)
+
+    def submit_tool_outputs(self, body, thread_id, run_id):
+        with self.lock:
+            run = self.runs.get(run_id)
+            if run is None:
+                return 404, {"error": {"message": "No run found"}}
+            run["step"] += 1
+            run["ready_at"] = time.time() + self.run_latency
+        return self.respond(run, body.get("stream"), "thread.run.queued")
+
+    def cancel_run(self, body, thread_id, run_id):
+        with self.lock:
+            run = self.runs.get(run_id)
+            if run is None:
+                return 404, {"error": {"message": "No run found"}}
+            run["cancelled"] = True
+        return 200, self.run_object(run)
+
+    def respond(self, run, stream, first_event):
+        if not stream:
+            return 200, self.run_object(run)
+        events = [(first_event, self.run_object(run))]
+        time.sleep(max(0, run["ready_at"] - time.time()))
+        state = self.run_object(run)
+        events.append((f"thread.run.{state['status']}", state))
+        events.append(("done", "[DONE]"))
+        return 200, None, events
+
+    def run_object(self, run):
+        state = {
+            "id": run["id"],
+            "object": "thread.run",
+            "created_at": int(time.time()),
+            "thread_id": run["thread_id"],
+            "assistant_id": run["assistant_id"],
+            "status": "in_progress",
+            "required_action": None,
+            "instructions": "",
+            "model": "fake",
+            "tools": [],
+            "parallel_tool_calls": True,
+        }
+        if run.get("cancelled"):
+            state["status"] = "cancelled"
+            return state
+        if time.time() < run["ready_at"]:
+            return state
+        if run["step"] >= len(self.script):
+            state["status"] = "completed"
+            return state
+
+        state["status"] = "requires_action"
+        state["required_action"] = {
+            "type": "submit_tool_outputs",
+            "submit_tool_outputs": {
+                "tool_calls": [
+                    {
+                        "id": f"call_{run['step']}_{i}",
+                        "type": "function",
+                        "function": {
+                            "name": call["name"],
+                            "arguments": json.dumps(call["arguments"]),
+                        },
+                    }
+                    for i, call in enumerate(self.script[run["step"]])
+                ]
+            },
+        }
+        return state
@@ -0,0 +1,419 @@
+"""
+End-to-end benchmark for gort.
+
+Starts local stand-ins for the GitHub/Gitea REST API and the Assistants API, a
+bare git remote for the bot's fork, and gort.py itself, then replays a stream of
+issue webhooks and reports webhook-to-comment latency, throughput and peak memory.
+
+    python bench/run.py --events 60 --issues 15 --rate 10
+    python bench/run.py --replay webhooks.jsonl --poll
+"""
+
+# stdlib
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+# pip
+import requests
+import toml
+
+# local
+from fakes import FakeAssistants, FakeForge
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT = "therattestman"
+
+DEFAULT_SCRIPT = [
+    [
+        {"name": "shell", "arguments": {"command": "ls"}},
+        {"name": "shell", "arguments": {"command": "cat README.md"}},
+    ],
+    [{"name": "shell", "arguments": {"command": "grep -rn def ."}}],
+]
+
+EVENT_HEADERS = {
+    "github": ("X-GitHub-Event", "X-GitHub-Delivery"),
+    "gitea": ("X-Gitea-Event", "X-Gitea-Delivery"),
+}
+
+GIT_ENV = {
+    "GIT_AUTHOR_NAME": "gort bench",
+    "GIT_AUTHOR_EMAIL": "bench@example.com",
+    "GIT_COMMITTER_NAME": "gort bench",
+    "GIT_COMMITTER_EMAIL": "bench@example.com",
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1, round(pct / 100 * len(values)) - 1))
+    return values[rank]
+
+
+def seed_remote(remotes, repo):
+    """
+    Creates a bare repo at remotes/<repo>.git with a few files on main, to serve
+    as the bot's fork.
+    """
+    bare = os.path.join(remotes, f"{repo}.git")
+    if os.path.exists(bare):
+        return
+    work = os.path.join(remotes, f"{repo}-seed")
+    os.makedirs(os.path.join(work, "src"))
+    with open(os.path.join(work, "README.md"), "w") as f:
+        f.write(f"# {repo}\n\nA repository for benchmarking gort.\n")
+    for i in range(20):
+        with open(os.path.join(work, "src", f"module{i}.py"), "w") as f:
+            f.write(
+                "".join(
+                    f"def func{i}_{j}(x):\n    return x + {j}\n\n" for j in range(20)
+                )
+            )
+
+    env = dict(os.environ, **GIT_ENV)
+    for args in (
+        ["init", "-q", "-b", "main"],
+        ["add", "."],
+        ["commit", "-q", "-m", "Initial commit"],
+    ):
+        subprocess.run(["git", *args], cwd=work, env=env, check=True)
+    subprocess.run(["git", "clone", "-q", "--bare", work, bare], check=True)
+    shutil.rmtree(work)
+
+
+def synthetic_events(count, issues, provider):
+    """
+    Yields webhook events spread round-robin over issues in one repo.
+    """
+    for i in range(count):
+        number = i % issues + 1
+        yield provider, "issue_comment", {
+            "action": "created",
+            "issue": {"number": number, "title": f"Issue {number}", "body": "Help"},
+            "comment": {"body": f"Comment {i}"},
+            "repository": {"name": "sample", "owner": {"login": "bench"}},
+        }
+
+
+def replayed_events(path, provider):
+    """
+    Yields webhook events from a JSONL file of {"event", "payload"} objects, with
+    an optional "provider" on each.
+    """
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                yield entry.get("provider", provider), entry["event"], entry["payload"]
+
+
+def write_config(rundir, args, port, forge, assistants, remotes):
+    config = {
+        "gitea_endpoint": forge.url,
+        "gitea_username": BOT,
+        "gitea_password": "bench",
+        "gitea_token": "bench",
+        "github_username": BOT,
+        "github_pat": "bench",
+        "github_api_url": forge.url,
+        "fork_url": "file://" + os.path.join(remotes, "{repo}.git"),
+        "ai_token": "bench",
+        "ai_assistant_id": "asst_bench",
+        "ai_base_url": assistants.url + "/",
+        "ai_stream_runs": not args.poll,
+        "worker_count": args.workers,
+        "debounce_seconds": args.debounce,
+        "host": "127.0.0.1",
+        "port": port,
+    }
+    if args.worker_processes:
+        config["job_broker"] = "sqlite"
+        config["worker_metrics_port"] = free_port()
+    config.update(args.set)
+    with open(os.path.join(rundir, "config.toml"), "w") as f:
+        toml.dump(config, f)
+
+
+def peak_memory_mb(pid):
+    """
+    Returns:
+        float or None: The process's peak resident set size, from /proc (Linux only).
+    """
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def process_tree(pid):
+    """
+    Returns:
+        list: pid and the pids of all its descendants, from /proc (Linux only).
+    """
+    pids = [pid]
+    for parent in pids:
+        try:
+            with open(f"/proc/{parent}/task/{parent}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def wait_for(url, proc, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("gort exited during startup, see gort.log")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError("gort didn't start listening in time")
+
+
+def latencies(sent, posted):
+    """
+    Pairs each bot comment with the webhooks it answered: those for its issue
+    sent before it and not answered yet. A comment's latency is measured from
+    the oldest of them, so coalesced events count once.
+
+    Args:
+        sent (dict): Issue key -> send times of its webhooks.
+        posted (list): (time, issue key) for each bot comment.
+    """
+    pending = {key: sorted(times) for key, times in sent.items()}
+    result = []
+    for at, key in sorted(posted):
+        waiting = [t for t in pending.get(key, []) if t <= at]
+        if not waiting:
+            continue
+        result.append(at - waiting[0])
+        pending[key] = [t for t in pending[key] if t > at]
+    return result
+
+
+def run(args):
+    script = DEFAULT_SCRIPT
+    if args.script:
+        with open(args.script) as f:
+            script = json.load(f)
+
+    tmp = tempfile.mkdtemp(prefix="gort-bench-")
+    remotes = os.path.join(tmp, "remotes")
+    rundir = os.path.join(tmp, "run")
+    os.makedirs(remotes)
+    os.makedirs(rundir)
+
+    if args.replay:
+        events = list(replayed_events(args.replay, args.provider))
+    else:
+        events = list(synthetic_events(args.events, args.issues, args.provider))
+    for _, _, payload in events:
+        seed_remote(remotes, payload["repository"]["name"])
+
+    forge = FakeForge(BOT, latency=args.api_latency).start()
+    assistants = FakeAssistants(
+        script, latency=args.api_latency, run_latency=args.model_latency
+    ).start()
+    port = free_port()
+    write_config(rundir, args, port, forge, assistants, remotes)
+
+    log = open(os.path.join(rundir, "gort.log"), "w")
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "gort.py")],
+        cwd=rundir,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+        env=dict(os.environ, PYTHONUNBUFFERED="1", **GIT_ENV),
+    )
+    workers = None
+    if args.worker_processes:
+        workers = subprocess.Popen(
+            [
+                sys.executable,
+                os.path.join(ROOT, "gort.py"),
+                "worker",
+                "--processes",
+                str(args.worker_processes),
+            ],
+            cwd=rundir,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            env=dict(os.environ, PYTHONUNBUFFERED="1", **GIT_ENV),
+        )
+    gort = f"http://127.0.0.1:{port}"
+    try:
+        wait_for(f"{gort}/metrics", proc)
+
+        sent = {}
+        started = time.time()
+        for i, (provider, event, payload) in enumerate(events):
+            if args.rate:
+                time.sleep(max(0, started + i / args.rate - time.time()))
+            owner = payload["repository"]["owner"]["login"]
+            repo = payload["repository"]["name"]
+            number = payload["issue"]["number"]
+            key = (owner, repo, number)
+            if event == "issue_comment":
+                body = payload.get("comment", {}).get("body", "")
+                forge.add_comment(owner, repo, number, "bench-user", body)
+
+            event_header, delivery_header = EVENT_HEADERS[provider]
+            sent.setdefault(key, []).append(time.time())
+            requests.post(
+                f"{gort}/{provider}/webhook",
+                json=payload,
+                headers={event_header: event, delivery_header: str(uuid.uuid4())},
+                timeout=30,
+            )
+        sent_at = time.time()
+
+        deadline = sent_at + args.timeout
+        with forge.changed:
+            while not all(forge.answered(key) for key in sent):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                forge.changed.wait(remaining)
+            posted = list(forge.posted)
+        finished = time.time()
+        memory = peak_memory_mb(proc.pid)
+        worker_memory = None
+        if workers is not None:
+            peaks = [peak_memory_mb(pid) for pid in process_tree(workers.pid)]
+            worker_memory = sum(peak for peak in peaks if peak is not None)
+    finally:
+        for child in (proc, workers):
+            if child is None:
+                continue
+            child.terminate()
+            try:
+                child.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                child.kill()
+        log.close()
+
+    lat = latencies(sent, posted)
+    elapsed = (max(at for at, _ in posted) if posted else finished) - started
+    report = {
+        "webhooks": len(events),
+        "issues": len(sent),
+        "comments": len(posted),
+        "unanswered": sum(1 for key in sent if not forge.answered(key)),
+        "p50_seconds": percentile(lat, 50),
+        "p99_seconds": percentile(lat, 99),
+        "max_seconds": max(lat) if lat else None,
+        "jobs_per_minute": len(posted) / elapsed * 60 if elapsed > 0 else None,
+        "send_seconds": sent_at - started,
+        "peak_memory_mb": memory,
+        "forge_requests": forge.server.requests,
+        "assistant_requests": assistants.server.requests,
+    }
+
+    if worker_memory is not None:
+        # peak_memory_mb is only the front-end; this sums the worker processes
+        report["worker_peak_memory_mb"] = worker_memory
+
+    if args.keep:
+        report["run_dir"] = rundir
+    else:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return report
+
+
+def print_report(report):
+    for name, value in report.items():
+        if isinstance(value, float):
+            value = f"{value:.3f}"
+        print(f"{name:>21}: {value}")
+
+
+def parse_setting(text):
+    key, _, value = text.partition("=")
+    return key, toml.loads(f"v = {value}")["v"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=40, help="webhooks to send")
+    parser.add_argument(
+        "--issues", type=int, default=10, help="issues to spread them over"
+    )
+    parser.add_argument(
+        "--rate", type=float, default=10, help="webhooks per second, 0 for all at once"
+    )
+    parser.add_argument("--provider", choices=sorted(EVENT_HEADERS), default="github")
+    parser.add_argument("--replay", help="JSONL file of webhooks to send instead")
+    parser.add_argument("--script", help="JSON file of tool call steps for each run")
+    parser.add_argument("--workers", type=int, default=8, help="gort's worker_count")
+    parser.add_argument(
+        "--worker-processes",
+        type=int,
+        default=0,
+        help="run jobs in this many `gort.py worker` processes instead of the "
+        "front-end",
+    )
+    parser.add_argument(
+        "--debounce", type=float, default=0.5, help="gort's debounce_seconds"
+    )
+    parser.add_argument(
+        "--poll", action="store_true", help="poll runs instead of streaming"
+    )
+    parser.add_argument(
+        "--api-latency",
+        type=float,
+        default=0.02,
+        help="seconds added to every fake API response",
+    )
+    parser.add_argument(
+        "--model-latency", type=float, default=0.5, help="seconds each run step takes"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=300, help="seconds to wait for replies"
+    )
+    parser.add_argument(
+        "--set",
+        type=parse_setting,
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="extra config.toml setting (TOML value)",
+    )
+    parser.add_argument(
+        "--keep", action="store_true", help="keep the run directory and gort.log"
+    )
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+    args.set = dict(args.set)
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
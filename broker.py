@@ -0,0 +1,90 @@
+# stdlib
+import importlib
+from abc import ABC, abstractmethod
+import os
+import socket
+import time
+
+
+class Broker(ABC):
+    """
+    Hands jobs from the webhook front-end (gort.py serve) to worker processes
+    (gort.py worker).
+
+    Every job is recorded in the JobStore first, so a broker only has to move
+    job ids around and say which ones a worker should run. To plug in another
+    queue, subclass this and set job_broker to "module:Class" in the config.
+    """
+
+    def __init__(self, config, job_store):
+        self.config = config
+        self.job_store = job_store
+        self.worker = f"{socket.gethostname()}-{os.getpid()}"
+
+    @abstractmethod
+    def publish(self, job_id):
+        """
+        Makes a newly recorded job available to workers.
+        """
+
+    @abstractmethod
+    def claim(self):
+        """
+        Returns:
+            dict or None: The next job this worker should run, if any.
+        """
+
+    def heartbeat(self):
+        """
+        Tells the broker this worker is still alive. Called regularly by the
+        worker loop, so jobs of a worker that died can be handed to another.
+        """
+
+
+class SqliteBroker(Broker):
+    def __init__(self, config, job_store):
+        """
+        Uses the jobs table in state_db as the queue, so the front-end and
+        workers only need to share that file. Fine for any number of processes
+        on one host; for several hosts, use a broker backed by a network queue
+        instead, since SQLite locking over network filesystems isn't reliable.
+        """
+        super().__init__(config, job_store)
+        self.debounce = config.get("debounce_seconds", 2)
+        self.lease = config.get("worker_lease", 60)
+        self.heartbeat_at = 0
+
+    def publish(self, job_id):
+        # Recording the job already queued it
+        pass
+
+    def claim(self):
+        return self.job_store.claim(
+            self.worker, debounce=self.debounce, lease=self.lease
+        )
+
+    def heartbeat(self):
+        if time.time() - self.heartbeat_at < self.lease / 3:
+            return
+        self.job_store.heartbeat(self.worker)
+        self.heartbeat_at = time.time()
+
+
+BROKERS = {"sqlite": SqliteBroker}
+
+
+def get_broker(config, job_store):
+    """
+    Returns:
+        Broker or None: The broker named by job_broker, or None for "local"
+        (the default), where the front-end runs jobs itself.
+    """
+    name = config.get("job_broker", "local")
+    if name == "local":
+        return None
+    if name in BROKERS:
+        return BROKERS[name](config, job_store)
+    if ":" not in name:
+        raise ValueError(f"Unknown job broker: {name}")
+    module, cls = name.split(":", 1)
+    return getattr(importlib.import_module(module), cls)(config, job_store)
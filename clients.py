@@ -0,0 +1,35 @@
+# stdlib
+import threading
+
+# local
+from gitea import GiteaApi
+from github import GitHubApi
+
+_clients = {}
+# Reentrant, since building llmUtils asks for the shared GitHubApi
+_clients_lock = threading.RLock()
+
+
+def shared(name, build):
+    """
+    Returns the process-wide client called name, building it on first use.
+    """
+    with _clients_lock:
+        if name not in _clients:
+            _clients[name] = build()
+        return _clients[name]
+
+
+def gitea(config):
+    return shared("gitea", lambda: GiteaApi(config))
+
+
+def github(config):
+    return shared("github", lambda: GitHubApi(config))
+
+
+def llm(config):
+    # Importing openai takes over a second, so wait until a job needs it
+    from aiutils import llmUtils
+
+    return shared("llm", lambda: llmUtils(config, git=github(config)))
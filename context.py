@@ -0,0 +1,249 @@
+# stdlib
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+
+# pip
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+BOT_LOGIN = "therattestman"
+
+# ``` or ~~~ fenced blocks, with whatever info string follows the fence
+FENCE_PATTERN = re.compile(r"^(```|~~~)[^\n]*\n(.*?)^\1[ \t]*$", re.M | re.S)
+
+_encoding = None
+
+
+def count_tokens(text):
+    """
+    Returns:
+        int: The number of tokens in text, from tiktoken when it's installed or
+        about four characters a token when it isn't.
+    """
+    global _encoding
+    if not text:
+        return 0
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def trim_lines(text, max_tokens):
+    """
+    Keeps the start and end of text around a marker saying how many lines were
+    left out, so it fits in about max_tokens. The end of a log is usually where
+    the error is, so it gets as much room as the start.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    lines = text.split("\n")
+    head, tail = [], []
+    used = 0
+    i, j = 0, len(lines) - 1
+    while i <= j:
+        # Alternate between the start and the end
+        take_head = len(head) <= len(tail)
+        line = lines[i] if take_head else lines[j]
+        cost = count_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        used += cost
+        if take_head:
+            head.append(line)
+            i += 1
+        else:
+            tail.append(line)
+            j -= 1
+    skipped = j - i + 1
+    if skipped <= 0:
+        return text
+    if not head and not tail:
+        # One huge line: fall back to characters
+        chars = max_tokens * 2
+        return f"{text[:chars]}\n[... trimmed ...]\n{text[-chars:]}"
+    return "\n".join(head + [f"[... {skipped} lines trimmed ...]"] + tail[::-1])
+
+
+def trim_blocks(text, max_tokens):
+    """
+    Trims each fenced code or log block in text that's longer than max_tokens.
+    A long message with no fences at all is trimmed as a whole, since pasted
+    logs often aren't fenced.
+    """
+    if not text or count_tokens(text) <= max_tokens:
+        return text or ""
+
+    def trim(match):
+        opening = match.group(0).split("\n", 1)[0]
+        inner = trim_lines(match.group(2).rstrip("\n"), max_tokens)
+        return f"{opening}\n{inner}\n{match.group(1)}"
+
+    trimmed = FENCE_PATTERN.sub(trim, text)
+    if trimmed == text and not FENCE_PATTERN.search(text):
+        trimmed = trim_lines(text, max_tokens)
+    return trimmed
+
+
+def author(comment):
+    return comment["user"]["login"] if "user" in comment else "mystery"
+
+
+def comment_role(comment):
+    return "user" if author(comment) != BOT_LOGIN else "assistant"
+
+
+def heuristic_summary(text, max_chars=300):
+    """
+    Returns:
+        str: The prose at the start of text, without code blocks, cut at a
+        sentence boundary when there is one.
+    """
+    prose = FENCE_PATTERN.sub("[code block]", text or "")
+    prose = " ".join(prose.split())
+    if len(prose) <= max_chars:
+        return prose
+    cut = prose[:max_chars]
+    end = max(cut.rfind(". "), cut.rfind("? "), cut.rfind("! "))
+    if end > max_chars // 3:
+        return cut[: end + 1]
+    return cut.rstrip() + "..."
+
+
+class SummaryStore:
+    def __init__(self, path):
+        """
+        Remembers the summary of each comment, so it's only made once.
+
+        Summaries are keyed by comment id and a hash of the body, so editing a
+        comment gets it summarized again.
+
+        Args:
+            path (str): The SQLite file to keep the summaries in.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS comment_summaries ("
+                "comment_id INTEGER, body_hash TEXT, summary TEXT, "
+                "PRIMARY KEY (comment_id, body_hash))"
+            )
+            self.db.commit()
+
+    @staticmethod
+    def body_hash(body):
+        return hashlib.sha1((body or "").encode()).hexdigest()
+
+    def get(self, comment_id, body):
+        """
+        Returns:
+            str or None: The stored summary, if the comment has one.
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT summary FROM comment_summaries WHERE comment_id = ? AND body_hash = ?",
+                (comment_id, self.body_hash(body)),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, comment_id, body, summary):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO comment_summaries VALUES (?, ?, ?)",
+                (comment_id, self.body_hash(body), summary),
+            )
+            self.db.commit()
+
+
+class ContextBuilder:
+    def __init__(self, config, summarize=None):
+        """
+        Builds the messages a new thread starts with, within a token budget.
+
+        The title and body always go in. Then comments are added newest first:
+        the most recent ones verbatim (with oversized code and log blocks
+        trimmed), and once the budget is tight, older ones as one-line summaries
+        collected into a single message. If even the summaries don't fit, the
+        oldest are left out and the message says how many.
+
+        Args:
+            config (dict): The gort config.
+            summarize (callable): Turns a comment's text into a summary. Defaults
+                to keeping its first sentences.
+        """
+        self.budget = config.get("context_token_budget", 12000)
+        self.block_tokens = config.get("context_block_tokens", 800)
+        self.keep_recent = config.get("context_keep_recent", 4)
+        self.summaries = SummaryStore(config.get("state_db", "gort.db"))
+        self.summarize = summarize or heuristic_summary
+
+    def trim(self, text):
+        return trim_blocks(text, self.block_tokens)
+
+    def message(self, comment):
+        return {"role": comment_role(comment), "content": self.trim(comment["body"])}
+
+    def summary(self, comment):
+        comment_id = comment.get("id")
+        body = comment.get("body") or ""
+        if comment_id is not None:
+            cached = self.summaries.get(comment_id, body)
+            if cached is not None:
+                return cached
+        summary = self.summarize(body)
+        if comment_id is not None:
+            self.summaries.set(comment_id, body, summary)
+        return summary
+
+    def build(self, comments, title, body=None):
+        """
+        Returns:
+            list: Messages for the thread, oldest first.
+        """
+        dialogue = [{"role": "user", "content": "Issue is titled: " + title}]
+        if body:
+            dialogue.append(
+                {"role": "user", "content": "Issue body: " + self.trim(body)}
+            )
+        used = sum(count_tokens(m["content"]) for m in dialogue)
+
+        recent = []
+        older = list(comments)
+        while older:
+            message = self.message(older[-1])
+            cost = count_tokens(message["content"])
+            if len(recent) >= self.keep_recent and used + cost > self.budget:
+                break
+            recent.append(message)
+            older.pop()
+            used += cost
+        recent.reverse()
+
+        if older:
+            lines = []
+            for comment in reversed(older):
+                line = f"- {author(comment)}: {self.summary(comment)}"
+                cost = count_tokens(line) + 1
+                if lines and used + cost > self.budget:
+                    break
+                lines.append(line)
+                used += cost
+            lines.reverse()
+            header = "Summary of earlier comments"
+            omitted = len(older) - len(lines)
+            if omitted:
+                header += f" ({omitted} older comments left out)"
+            dialogue.append(
+                {"role": "user", "content": header + ":\n" + "\n".join(lines)}
+            )
+
+        return dialogue + recent
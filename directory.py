@@ -0,0 +1,45 @@
+# stdlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DirectoryCrawler:
+    def __init__(self, api, workers=8, ttl=600):
+        """
+        Lists every user and organization a client can see.
+
+        Organization lookups for all users run concurrently, and the result is
+        cached for ttl seconds.
+
+        Args:
+            api (GiteaApi or GitHubApi): The client to crawl with.
+            workers (int): How many get_user_orgs requests may run at once.
+            ttl (float): How long a crawl stays cached, in seconds.
+        """
+        self.api = api
+        self.workers = workers
+        self.ttl = ttl
+        self.names = None
+        self.crawled_at = 0
+        self.lock = threading.Lock()
+
+    def get_all_names(self):
+        """
+        Returns:
+            list: Every username, followed by every organization they belong to.
+        """
+        with self.lock:
+            if self.names is not None and time.time() - self.crawled_at < self.ttl:
+                return list(self.names)
+
+            users = self.api.get_users()
+            # dicts keep insertion order, so these double as ordered sets
+            names = dict.fromkeys(users)
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for orgs in pool.map(self.api.get_user_orgs, users):
+                    names.update(dict.fromkeys(orgs))
+
+            self.names = list(names)
+            self.crawled_at = time.time()
+            return list(self.names)
@@ -1,9 +1,20 @@
-# pip
-import requests
+# local
+from directory import DirectoryCrawler
+from metrics import instrument_client
+from providers import GiteaProvider, get_provider, iterate, run
+from tracing import trace_client
 
 
+@instrument_client("gitea")
+@trace_client("gitea")
 class GiteaApi:
     def __init__(self, config):
+        """
+        A blocking client for the Gitea API.
+
+        Each method runs the matching GiteaProvider coroutine on the shared
+        event loop; use self.provider directly from async code.
+        """
         self.token = config["gitea_token"]
         self.username = config["gitea_username"]
         self.password = config["gitea_password"]
@@ -13,31 +24,26 @@ class GiteaApi:
             "Authorization": f"token {self.token}",
             "Content-Type": "application/json",
         }
+        self.provider = get_provider(
+            GiteaProvider, config, f"{self.url}/api/v1", self.headers
+        )
+        self.directory = DirectoryCrawler(
+            self,
+            workers=config.get("directory_workers", 8),
+            ttl=config.get("directory_ttl", 600),
+        )
 
     def add_webhook(self, owner, repo, config):
-        url = f"{self.endpoint}/repos/{owner}/{repo}/hooks"
-        response = requests.post(url, headers=self.headers, data=json.dumps(config))
-        return response.json()
+        return run(self.provider.add_webhook(owner, repo, config))
 
     def get_users(self):
         """
-        Retrieves a list of usernames for all users from the API.
+        Retrieves a list of usernames for all users from the API, across every page.
 
         Returns:
             list: A list of usernames.
         """
-        response = requests.get(
-            f"{self.url}/api/v1/admin/users",
-            headers={"Authorization": f"token {self.token}"},
-        )
-        try:
-            stuff = response.json()
-            usernames = []
-            for user in stuff:
-                usernames.append(user["username"])
-            return usernames
-        except:
-            return [response.text]
+        return run(self.provider.get_users())
 
     def get_user_orgs(self, username):
         """
@@ -48,96 +54,96 @@ class GiteaApi:
 
         Returns:
             list: A list of organization usernames.
-
-        Raises:
-            Exception: If there is an error in the API response.
         """
-        response = requests.get(
-            f"{self.url}/api/v1/users/{username}/orgs",
-            headers={"Authorization": f"token {self.token}"},
-        )
-        try:
-            stuff = response.json()
-            orgs = []
-            for org in stuff:
-                orgs.append(org["username"])
-            return orgs
-        except:
-            return [response.text]
+        return run(self.provider.get_user_orgs(username))
 
     def get_all_names(self):
         """
         Retrieves all names from users and organizations.
 
+        Org lookups run concurrently and the result is cached; see DirectoryCrawler.
+
         Returns:
             list: A list of names from users and organizations.
         """
-        users = self.get_users()
-        orgs = []
-        for user in users:
-            for uorg in self.get_user_orgs(user):
-                if uorg not in orgs:
-                    orgs.append(uorg)
-        return users + orgs
+        return self.directory.get_all_names()
+
+    def iter_user_repos(self, username, bulk=False):
+        """
+        Lazily yields the repositories of a given user, fetching pages as needed.
+
+        Args:
+            username (str): The username of the user.
+            bulk (bool): Request the largest page size Gitea allows.
+
+        Yields:
+            dict: Each repository.
+        """
+        return iterate(self.provider.iter_user_repos(username, bulk))
 
     def get_user_repos(self, username):
         """
-        Retrieves the repositories of a given user.
+        Retrieves all repositories of a given user.
 
         Args:
             username (str): The username of the user.
 
         Returns:
-            dict or str: A dictionary containing the JSON response if successful, or the response text if an error occurred.
+            list or dict: A list of repositories if successful, or the error response if an error occurred.
         """
-        response = requests.get(
-            f"{self.url}/api/v1/users/{username}/repos",
-            headers={"Authorization": f"token {self.token}"},
-        )
-        try:
-            return response.json()
-        except:
-            return response.text
+        return run(self.provider.get_user_repos(username))
+
+    def iter_prs(self, repo, bulk=False):
+        """
+        Lazily yields the pull requests for a given repository.
+
+        Args:
+            repo (str): The name of the repository.
+            bulk (bool): Request the largest page size Gitea allows.
+
+        Yields:
+            dict: Each pull request.
+        """
+        return iterate(self.provider.iter_prs(repo, bulk))
 
     def get_prs(self, repo):
         """
-        Get a list of pull requests for a given repository.
+        Get a list of all pull requests for a given repository.
 
         Args:
             repo (str): The name of the repository.
 
         Returns:
-            list: A list of pull requests in JSON format, or the response text if an error occurs.
+            list: A list of pull requests in JSON format, or the error response if an error occurs.
         """
-        response = requests.get(
-            f"{self.url}/api/v1/repos/{repo}/pulls",
-            headers={"Authorization": f"token {self.token}"},
-        )
-        try:
-            return response.json()
-        except:
-            return response.text
+        return run(self.provider.get_prs(repo))
+
+    def iter_issues(self, owner, repo, bulk=False):
+        """
+        Lazily yields the issues for a given repository.
+
+        Args:
+            owner (str): The owner of the repository.
+            repo (str): The name of the repository.
+            bulk (bool): Request the largest page size Gitea allows.
+
+        Yields:
+            dict: Each issue.
+        """
+        return iterate(self.provider.iter_issues(owner, repo, bulk))
 
     def get_issues(self, owner, repo):
         """
-        Retrieves the issues for a given repository.
+        Retrieves all issues for a given repository.
 
         Args:
             owner (str): The owner of the repository.
             repo (str): The name of the repository.
 
         Returns:
-            dict or str: A dictionary containing the parsed JSON response if successful,
-                         otherwise the raw response text.
+            list or dict: A list of issues if successful, otherwise the error response.
         """
-        response = requests.get(
-            f"{self.url}/api/v1/repos/{owner}/{repo}/issues",
-            headers={"Authorization": f"token {self.token}"},
-        )
-        try:
-            return response.json()
-        except:
-            return response.text
+        return run(self.provider.get_issues(owner, repo))
 
     def get_issue(self, owner, repo, issuen):
         """
@@ -151,35 +157,40 @@ class GiteaApi:
         Returns:
             dict or str: The JSON response containing the issue if successful, or the error message if unsuccessful.
         """
-        response = requests.get(
-            f"{self.url}/api/v1/repos/{owner}/{repo}/issues/{issuen}",
-            headers={"Authorization": f"token {self.token}"},
+        return run(self.provider.get_issue(owner, repo, issuen))
+
+    def iter_issue_comments(self, owner, repo, issuen, bulk=False, reverse=False):
+        """
+        Lazily yields the comments for a specific issue in a repository.
+
+        Args:
+            owner (str): The owner of the repository.
+            repo (str): The name of the repository.
+            issuen (int): The issue number.
+            bulk (bool): Request the largest page size Gitea allows.
+            reverse (bool): Yield the newest comments first.
+
+        Yields:
+            dict: Each comment.
+        """
+        return iterate(
+            self.provider.iter_issue_comments(owner, repo, issuen, bulk, reverse)
         )
-        try:
-            return response.json()
-        except:
-            return {"msg": response.text}
 
-    def get_issue_comments(self, owner, repo, issuen):
+    def get_issue_comments(self, owner, repo, issuen, last=None):
         """
-        Retrieves the comments for a specific issue in a repository.
+        Retrieves the comments for a specific issue in a repository, oldest first.
 
         Args:
             owner (str): The owner of the repository.
             repo (str): The name of the repository.
             issuen (int): The issue number.
+            last (int, optional): Only return the newest `last` comments.
 
         Returns:
-            dict or str: The JSON response containing the comments if successful, or the error message if unsuccessful.
+            list or dict: The comments if successful, or the error message if unsuccessful.
         """
-        response = requests.get(
-            f"{self.url}/api/v1/repos/{owner}/{repo}/issues/{issuen}/comments",
-            headers={"Authorization": f"token {self.token}"},
-        )
-        try:
-            return response.json()
-        except:
-            return {"msg": response.text}
+        return run(self.provider.get_issue_comments(owner, repo, issuen, last))
 
     def post_issue_comment(self, owner, repo, issuen, comment):
         """
@@ -194,14 +205,7 @@ class GiteaApi:
         Returns:
             str: The response text.
         """
-
-        response = requests.post(
-            f"{self.url}/api/v1/repos/{owner}/{repo}/issues/{issuen}/comments",
-            headers={"Authorization": f"token {self.token}"},
-            json={"body": comment},
-        )
-
-        return response.json()
+        return run(self.provider.post_issue_comment(owner, repo, issuen, comment))
 
     def get_repo(self, owner, repo):
         """
@@ -214,14 +218,7 @@ class GiteaApi:
         Returns:
             dict or str: The JSON response containing the repository if successful, or the error message if unsuccessful.
         """
-        response = requests.get(
-            f"{self.url}/api/v1/repos/{owner}/{repo}",
-            headers={"Authorization": f"token {self.token}"},
-        )
-        try:
-            return response.json()
-        except:
-            return {"msg": response.text}
+        return run(self.provider.get_repo(owner, repo))
 
     def fork_repo(self, owner, repo):
         """
@@ -234,15 +231,7 @@ class GiteaApi:
         Returns:
             dict or str: The JSON response containing the repository if successful, or the error message if unsuccessful.
         """
-        response = requests.post(
-            f"{self.url}/api/v1/repos/{owner}/{repo}/forks",
-            headers={"Authorization": f"token {self.token}"},
-            json={"name": repo},
-        )
-        try:
-            return response.json()
-        except:
-            return {"msg": response.text}
+        return run(self.provider.fork_repo(owner, repo))
 
     def create_pull_request(
         self, owner, repo, title, body, source_branch, target_branch
@@ -261,20 +250,11 @@ class GiteaApi:
         Returns:
             dict or str: The JSON response containing the pull request if successful, or the error message if unsuccessful.
         """
-        response = requests.post(
-            f"{self.url}/api/v1/repos/{owner}/{repo}/pulls",
-            headers={"Authorization": f"token {self.token}"},
-            json={
-                "title": title,
-                "body": body,
-                "head": source_branch,
-                "base": target_branch,
-            },
+        return run(
+            self.provider.create_pull_request(
+                owner, repo, title, body, source_branch, target_branch
+            )
         )
-        try:
-            return response.json()
-        except:
-            return {"msg": response.text}
 
 
 if __name__ == "__main__":
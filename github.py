@@ -1,22 +1,37 @@
-import requests
-import json
 import toml
 
-# pip
+# local
+from directory import DirectoryCrawler
+from metrics import instrument_client
+from providers import GitHubProvider, get_provider, iterate, run
+from tracing import trace_client
 
 
+@instrument_client("github")
+@trace_client("github")
 class GitHubApi:
     def __init__(self, config):
+        """
+        A blocking client for the GitHub API.
+
+        Each method runs the matching GitHubProvider coroutine on the shared
+        event loop; use self.provider directly from async code.
+        """
         self.token = config["github_pat"]
+        self.api_url = config.get("github_api_url", "https://api.github.com")
         self.headers = {
             "Authorization": f"token {self.token}",
             "Content-Type": "application/json",
         }
+        self.provider = get_provider(GitHubProvider, config, self.api_url, self.headers)
+        self.directory = DirectoryCrawler(
+            self,
+            workers=config.get("directory_workers", 8),
+            ttl=config.get("directory_ttl", 600),
+        )
 
     def add_webhook(self, owner, repo, config):
-        url = f"https://api.github.com/repos/{owner}/{repo}/hooks"
-        response = requests.post(url, headers=self.headers, data=json.dumps(config))
-        return response.json()
+        return run(self.provider.add_webhook(owner, repo, config))
 
     def get_users(self):
         """
@@ -25,7 +40,7 @@ class GitHubApi:
         Returns:
             list: A list of usernames.
         """
-        return ["SomethingGeneric"]
+        return run(self.provider.get_users())
 
     def get_user_orgs(self, username):
         """
@@ -36,97 +51,98 @@ class GitHubApi:
 
         Returns:
             list: A list of organization usernames.
-
-        Raises:
-            Exception: If there is an error in the API response.
         """
-        response = requests.get(
-            f"https://api.github.com/users/{username}/orgs",
-            headers=self.headers,
-        )
-        try:
-            stuff = response.json()
-            orgs = []
-            for org in stuff:
-                orgs.append(org["login"])
-            return orgs
-        except:
-            return [response.text]
+        return run(self.provider.get_user_orgs(username))
 
     def get_all_names(self):
         """
         Retrieves all names from users and organizations.
 
+        Org lookups run concurrently and the result is cached; see DirectoryCrawler.
+
         Returns:
             list: A list of names from users and organizations.
         """
-        users = self.get_users()
-        orgs = []
-        for user in users:
-            for uorg in self.get_user_orgs(user):
-                if uorg not in orgs:
-                    orgs.append(uorg)
-        return users + orgs
+        return self.directory.get_all_names()
+
+    def iter_user_repos(self, username, bulk=False):
+        """
+        Lazily yields the repositories of a given user, fetching pages as needed.
+
+        Args:
+            username (str): The username of the user.
+            bulk (bool): Request the largest page size GitHub allows.
+
+        Yields:
+            dict: Each repository.
+        """
+        return iterate(self.provider.iter_user_repos(username, bulk))
 
     def get_user_repos(self, username):
         """
-        Retrieves the repositories of a given user.
+        Retrieves all repositories of a given user.
 
         Args:
             username (str): The username of the user.
 
         Returns:
-            dict or str: A dictionary containing the JSON response if successful, or the response text if an error occurred.
+            list or dict: A list of repositories if successful, or the error response if an error occurred.
         """
-        response = requests.get(
-            f"https://api.github.com/users/{username}/repos",
-            headers=self.headers,
-        )
-        try:
-            return response.json()
-        except:
-            return response.text
+        return run(self.provider.get_user_repos(username))
+
+    def iter_prs(self, owner, repo, bulk=False):
+        """
+        Lazily yields the pull requests for a given repository.
+
+        Args:
+            owner (str): The owner of the repository.
+            repo (str): The name of the repository.
+            bulk (bool): Request the largest page size GitHub allows.
+
+        Yields:
+            dict: Each pull request.
+        """
+        return iterate(self.provider.iter_prs(owner, repo, bulk))
 
     def get_prs(self, owner, repo):
         """
-        Get a list of pull requests for a given repository.
+        Get a list of all pull requests for a given repository.
 
         Args:
             owner (str): The owner of the repository.
             repo (str): The name of the repository.
 
         Returns:
-            list: A list of pull requests in JSON format, or the response text if an error occurs.
+            list: A list of pull requests in JSON format, or the error response if an error occurs.
         """
-        response = requests.get(
-            f"https://api.github.com/repos/{owner}/{repo}/pulls",
-            headers=self.headers,
-        )
-        try:
-            return response.json()
-        except:
-            return response.text
+        return run(self.provider.get_prs(owner, repo))
+
+    def iter_issues(self, owner, repo, bulk=False):
+        """
+        Lazily yields the issues for a given repository.
+
+        Args:
+            owner (str): The owner of the repository.
+            repo (str): The name of the repository.
+            bulk (bool): Request the largest page size GitHub allows.
+
+        Yields:
+            dict: Each issue.
+        """
+        return iterate(self.provider.iter_issues(owner, repo, bulk))
 
     def get_issues(self, owner, repo):
         """
-        Retrieves the issues for a given repository.
+        Retrieves all issues for a given repository.
 
         Args:
             owner (str): The owner of the repository.
             repo (str): The name of the repository.
 
         Returns:
-            dict or str: A dictionary containing the parsed JSON response if successful,
-                         otherwise the raw response text.
+            list or dict: A list of issues if successful, otherwise the error response.
         """
-        response = requests.get(
-            f"https://api.github.com/repos/{owner}/{repo}/issues",
-            headers=self.headers,
-        )
-        try:
-            return response.json()
-        except:
-            return response.text
+        return run(self.provider.get_issues(owner, repo))
 
     def get_issue(self, owner, repo, issue_number):
         """
@@ -140,35 +156,40 @@ class GitHubApi:
         Returns:
             dict or str: The JSON response containing the issue if successful, or the error message if unsuccessful.
         """
-        response = requests.get(
-            f"https://api.github.com/repos/{owner}/{repo}/issues/{issue_number}",
-            headers=self.headers,
+        return run(self.provider.get_issue(owner, repo, issue_number))
+
+    def iter_issue_comments(self, owner, repo, issue_number, bulk=False, reverse=False):
+        """
+        Lazily yields the comments for a specific issue in a repository.
+
+        Args:
+            owner (str): The owner of the repository.
+            repo (str): The name of the repository.
+            issue_number (int): The issue number.
+            bulk (bool): Request the largest page size GitHub allows.
+            reverse (bool): Yield the newest comments first.
+
+        Yields:
+            dict: Each comment.
+        """
+        return iterate(
+            self.provider.iter_issue_comments(owner, repo, issue_number, bulk, reverse)
         )
-        try:
-            return response.json()
-        except:
-            return {"msg": response.text}
 
-    def get_issue_comments(self, owner, repo, issue_number):
+    def get_issue_comments(self, owner, repo, issue_number, last=None):
         """
-        Retrieves the comments for a specific issue in a repository.
+        Retrieves the comments for a specific issue in a repository, oldest first.
 
         Args:
             owner (str): The owner of the repository.
             repo (str): The name of the repository.
             issue_number (int): The issue number.
+            last (int, optional): Only return the newest `last` comments.
 
         Returns:
-            dict or str: The JSON response containing the comments if successful, or the error message if unsuccessful.
+            list or dict: The comments if successful, or the error message if unsuccessful.
         """
-        response = requests.get(
-            f"https://api.github.com/repos/{owner}/{repo}/issues/{issue_number}/comments",
-            headers=self.headers,
-        )
-        try:
-            return response.json()
-        except:
-            return {"msg": response.text}
+        return run(self.provider.get_issue_comments(owner, repo, issue_number, last))
 
     def post_issue_comment(self, owner, repo, issue_number, comment):
         """
@@ -183,14 +204,7 @@ class GitHubApi:
         Returns:
             str: The response text.
         """
-
-        response = requests.post(
-            f"https://api.github.com/repos/{owner}/{repo}/issues/{issue_number}/comments",
-            headers=self.headers,
-            json={"body": comment},
-        )
-
-        return response.json()
+        return run(self.provider.post_issue_comment(owner, repo, issue_number, comment))
 
     def get_repo(self, owner, repo):
         """
@@ -203,14 +217,7 @@ class GitHubApi:
         Returns:
             dict or str: The JSON response containing the repository if successful, or the error message if unsuccessful.
         """
-        response = requests.get(
-            f"https://api.github.com/repos/{owner}/{repo}",
-            headers=self.headers,
-        )
-        try:
-            return response.json()
-        except:
-            return {"msg": response.text}
+        return run(self.provider.get_repo(owner, repo))
 
     def fork_repo(self, owner, repo):
         """
@@ -223,15 +230,7 @@ class GitHubApi:
         Returns:
             dict or str: The JSON response containing the repository if successful, or the error message if unsuccessful.
         """
-        response = requests.post(
-            f"https://api.github.com/repos/{owner}/{repo}/forks",
-            headers=self.headers,
-            json={"name": repo},
-        )
-        try:
-            return response.json()
-        except:
-            return {"msg": response.text}
+        return run(self.provider.fork_repo(owner, repo))
 
     def create_pull_request(self, owner, repo, title, body, head_branch, base_branch):
         """
@@ -248,20 +247,11 @@ class GitHubApi:
         Returns:
             dict or str: The JSON response containing the pull request if successful, or the error message if unsuccessful.
         """
-        response = requests.post(
-            f"https://api.github.com/repos/{owner}/{repo}/pulls",
-            headers=self.headers,
-            json={
-                "title": title,
-                "body": body,
-                "head": head_branch,
-                "base": base_branch,
-            },
+        return run(
+            self.provider.create_pull_request(
+                owner, repo, title, body, head_branch, base_branch
+            )
         )
-        try:
-            return response.json()
-        except:
-            return {"msg": response.text}
 
 
 if __name__ == "__main__":
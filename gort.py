@@ -1,59 +1,321 @@
 # stdlib
+import argparse
 import os
 import getpass
+import signal
 import time
 import json
+import subprocess
+import sys
+import traceback
 
 # pip
 import toml
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest, start_http_server
 
 # local
-from gitea import GiteaApi
-from github import GitHubApi
-from aiutils import llmUtils
+from broker import get_broker
+import clients
+import metrics
+from intake import Intake
+import jobstore
+from jobstore import JobStore
+import tracing
+from tracing import TraceStore
+from workers import WorkerPool
 
 app = Flask(__name__)
 
-# Configuration
-if not os.path.exists("config.toml"):
-    gitea_endpoint = input("Enter the Gitea endpoint: ")
-    gitea_username = input("Enter your bot's Gitea username: ")
-    gitea_password = getpass.getpass("Enter your bot's Gitea password: ")
-    token = getpass.getpass("Enter your bot's Gitea token: ")
-
-    ai_token = getpass.getpass("Enter your OpenAI token: ")
-    ai_assistant_id = input("Enter your OpenAI assistant ID: ")
-
-    github_username = input("Enter your bot's GitHub username: ")
-    github_pat = getpass.getpass("Enter your bot's GitHub personal access token: ")
-
-    with open("config.toml", "w") as f:
-        toml.dump(
-            {
-                "gitea_endpoint": gitea_endpoint,
-                "gitea_username": gitea_username,
-                "gitea_password": gitea_password,
-                "gitea_token": token,
-                "ai_token": ai_token,
-                "ai_assistant_id": ai_assistant_id,
-                "github_username": github_username,
-                "github_pat": github_pat,
-                "github_ssh_key": github_ssh_key,
-            },
-            f,
-        )
 
-config = None
-with open("config.toml") as f:
-    config = toml.load(f)
+def load_config(path="config.toml"):
+    """
+    Loads the bot config, asking for the required settings first if there's none.
+    """
+    if not os.path.exists(path):
+        gitea_endpoint = input("Enter the Gitea endpoint: ")
+        gitea_username = input("Enter your bot's Gitea username: ")
+        gitea_password = getpass.getpass("Enter your bot's Gitea password: ")
+        token = getpass.getpass("Enter your bot's Gitea token: ")
+
+        ai_token = getpass.getpass("Enter your OpenAI token: ")
+        ai_assistant_id = input("Enter your OpenAI assistant ID: ")
+
+        github_username = input("Enter your bot's GitHub username: ")
+        github_pat = getpass.getpass("Enter your bot's GitHub personal access token: ")
+
+        with open(path, "w") as f:
+            toml.dump(
+                {
+                    "gitea_endpoint": gitea_endpoint,
+                    "gitea_username": gitea_username,
+                    "gitea_password": gitea_password,
+                    "gitea_token": token,
+                    "ai_token": ai_token,
+                    "ai_assistant_id": ai_assistant_id,
+                    "github_username": github_username,
+                    "github_pat": github_pat,
+                },
+                f,
+            )
+
+    with open(path) as f:
+        return toml.load(f)
+
 
-mygitea = GiteaApi(config)
-mygithub = GitHubApi(config)
-aihelper = llmUtils(config)
+# Clients are built on first use (see clients.py), so starting up makes no requests
+config = load_config()
 
 ignored_users = config.get("ignored_users", [])
 
+worker_pool = WorkerPool(config.get("worker_count", 8))
+worker_pool.start()
+intake = Intake(worker_pool.submit, debounce=config.get("debounce_seconds", 2))
+trace_store = TraceStore(
+    config.get("trace_dir", "traces"), keep=config.get("trace_keep", 10)
+)
+job_store = JobStore(config.get("state_db", "gort.db"))
+# With a broker, webhooks are only recorded here and `gort.py worker` runs them
+broker = get_broker(config, job_store)
+if broker is None:
+    metrics.QUEUE_DEPTH.set_function(worker_pool.queue_depth)
+    metrics.JOBS_IN_FLIGHT.set_function(lambda: worker_pool.in_flight)
+else:
+    # The jobs run elsewhere, so the front-end reports them from the job table
+    metrics.QUEUE_DEPTH.set_function(job_store.count_waiting)
+    metrics.JOBS_IN_FLIGHT.set_function(job_store.count_in_flight)
+
+
+def handle_issue_event(
+    provider,
+    api,
+    bot_username,
+    user,
+    repo_name,
+    issue,
+    delivery_id=None,
+    received_at=None,
+    job_id=None,
+):
+    """
+    Runs the assistant for an issue and posts its reply. Called from a worker.
+
+    The job's progress is kept in the job store, so if the process dies part
+    way through, resume_jobs can finish it.
+
+    Args:
+        provider (str): "gitea" or "github".
+        api (GiteaApi or GitHubApi): The client for the provider that sent the event.
+        bot_username (str): The bot's username on that provider.
+        user (str): The owner of the repository.
+        repo_name (str): The name of the repository.
+        issue (dict): The issue object from the webhook payload.
+        delivery_id (str, optional): The webhook's delivery id, used to name the job's workspace.
+        received_at (float, optional): When the webhook arrived, to show queueing in the trace.
+        job_id (int, optional): The job's id in the job store. A new job is recorded if not given.
+    """
+    if job_id is None:
+        job_id = job_store.add(provider, user, repo_name, issue, delivery_id)
+    job_store.supersede(job_id)
+    with trace_store.job(
+        provider, user, repo_name, issue["number"], delivery_id
+    ), jobstore.track(job_store, job_id):
+        if received_at is not None:
+            tracing.record("queued", received_at, time.time())
+        try:
+            with metrics.JOB_SECONDS.labels(provider).time():
+                run_issue_job(
+                    provider, api, bot_username, user, repo_name, issue, delivery_id
+                )
+        except Exception as e:
+            jobstore.update("failed", error=str(e))
+            raise
+        jobstore.update("done")
+
+
+def run_issue_job(provider, api, bot_username, user, repo_name, issue, delivery_id):
+    issue_number = issue["number"]
+
+    # Fetch issue comments
+    with tracing.span("fetch_comments"):
+        comments = api.get_issue_comments(user, repo_name, issue_number)
+
+    if len(comments) != 0 and comments[-1]["user"]["login"] == bot_username:
+        print("I was the last commenter, skipping...")
+        return
+
+    job = jobstore.current()
+    if job is not None and job["state"] == "posting" and job["reply"] is not None:
+        # The reply was ready when the process stopped; don't ask the model again
+        ai_resp = job["reply"]
+    else:
+        ai_resp = clients.llm(config).get_response(
+            comments,
+            issue["title"],
+            issue["body"],
+            f"{user}/{repo_name}",
+            provider=provider,
+            issue_number=issue_number,
+            delivery_id=delivery_id,
+        )
+        jobstore.update("posting", reply=ai_resp)
+    print("Got from AI:", ai_resp)
+
+    # Post comment to the issue
+    with tracing.span("post_comment"):
+        api.post_issue_comment(user, repo_name, issue_number, ai_resp)
+    print("Posted response to issue", issue_number, "in", user, repo_name)
+
+
+def enqueue_issue_event(provider, api, bot_username, event, payload, delivery_id):
+    """
+    Validates an issue webhook and queues it for a worker.
+
+    Redeliveries are dropped, and bursts of events on one issue are coalesced
+    into a single run (see Intake).
+
+    Returns:
+        tuple: A JSON response and status code for the webhook route.
+    """
+    if event != "issues" and event != "issue_comment":
+        return jsonify({"status": "ignored"}), 200
+
+    if not payload:
+        return jsonify({"status": "error", "msg": "missing payload"}), 400
+
+    action = payload.get("action")
+    issue = payload.get("issue")
+    repository = payload.get("repository")
+
+    if action != "opened" and action != "created":
+        return jsonify({"status": "ignored"}), 200
+
+    if not issue or not repository:
+        return jsonify({"status": "error", "msg": "missing issue"}), 400
+
+    user = repository["owner"]["login"]
+    repo_name = repository["name"]
+
+    if intake.is_duplicate(delivery_id):
+        print("Already got delivery", delivery_id, "skipping...")
+        return jsonify({"status": "duplicate"}), 200
+
+    key = (provider, user, repo_name, issue["number"])
+    job_id = job_store.add(provider, user, repo_name, issue, delivery_id)
+    if broker is not None:
+        broker.publish(job_id)
+        print("Published issue", issue["number"], "in", user, repo_name)
+        return jsonify({"status": "queued"}), 202
+
+    if intake.add(
+        key,
+        handle_issue_event,
+        provider,
+        api,
+        bot_username,
+        user,
+        repo_name,
+        issue,
+        delivery_id=delivery_id,
+        received_at=time.time(),
+        job_id=job_id,
+    ):
+        print("Coalesced event for issue", issue["number"], "in", user, repo_name)
+    else:
+        print("Queued issue", issue["number"], "in", user, repo_name)
+
+    return jsonify({"status": "queued"}), 202
+
+
+def resume_jobs():
+    """
+    Requeues the jobs that were queued or in flight when the process stopped.
+
+    A job that had started a run polls that run instead of starting a new one,
+    and a job whose reply was ready just posts it. If an issue also has a newer
+    queued job, it runs once the in-flight one is done, since the thread can
+    only have one run at a time. They start right away through Intake, so a
+    new event for the same issue waits for them instead of replacing them.
+    """
+    issues = {}
+    for job in job_store.unfinished():
+        key = (job["provider"], job["owner"], job["repo"], job["issue"]["number"])
+        in_flight, queued = issues.get(key, (None, None))
+        if job["state"] == "queued":
+            queued = job
+        else:
+            in_flight, queued = job, None
+        issues[key] = (in_flight, queued)
+
+    for key, jobs in issues.items():
+        jobs = [job for job in jobs if job is not None]
+        for job in jobs:
+            print(
+                f"Resuming {job['state']} job {job['id']} for issue",
+                job["issue"]["number"],
+                "in",
+                job["owner"],
+                job["repo"],
+            )
+        intake.start(key, run_stored_jobs, jobs)
+
+
+def run_stored_jobs(jobs):
+    """
+    Runs jobs from the job store one after another, picking each up from the
+    state it was left in.
+    """
+    bots = {
+        "gitea": (clients.gitea, "gitea_username"),
+        "github": (clients.github, "github_username"),
+    }
+    for job in jobs:
+        client, username_key = bots[job["provider"]]
+        try:
+            handle_issue_event(
+                job["provider"],
+                client(config),
+                config[username_key],
+                job["owner"],
+                job["repo"],
+                job["issue"],
+                delivery_id=job["delivery_id"],
+                received_at=job["created_at"] if job["state"] == "queued" else None,
+                job_id=job["id"],
+            )
+        except Exception:
+            print(f"Job {job['id']} failed:")
+            traceback.print_exc()
+
+
+def intake_webhook(provider, api, bot_username, event, payload, delivery_id):
+    with metrics.WEBHOOK_SECONDS.labels(provider).time():
+        response, code = enqueue_issue_event(
+            provider, api, bot_username, event, payload, delivery_id
+        )
+    metrics.WEBHOOKS.labels(provider, response.json["status"]).inc()
+    return response, code
+
+
+@app.route("/metrics")
+def get_metrics():
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
+
+@app.route("/debug/trace/<provider>/<owner>/<repo>/<int:issue_number>")
+def get_trace(provider, owner, repo, issue_number):
+    """
+    Returns the latest job trace for an issue, for chrome://tracing or Perfetto.
+    Only served when debug_routes is enabled in the config.
+    """
+    if not config.get("debug_routes", False):
+        return jsonify({"status": "error", "msg": "not found"}), 404
+
+    trace = trace_store.latest(provider, owner, repo, issue_number)
+    if trace is None:
+        return jsonify({"status": "error", "msg": "no trace for this issue"}), 404
+    return jsonify(trace), 200
+
 
 @app.route("/gitea/register", methods=["POST"])
 def gt_register_repo():
@@ -69,7 +331,7 @@ def gt_register_repo():
         "events": ["issue", "issue_comment", "pull_request"],
         "active": True,
     }
-    response = mygitea.add_webhook(repo_owner, repo_name, webhook_config)
+    response = clients.gitea(config).add_webhook(repo_owner, repo_name, webhook_config)
 
     return jsonify(response), 200
 
@@ -78,38 +340,16 @@ def gt_register_repo():
 def gt_handle_webhook():
     payload = request.json
     event = request.headers.get("X-Gitea-Event")
+    delivery_id = request.headers.get("X-Gitea-Delivery")
 
-    if event == "issues" or event == "issue_comment":
-        action = payload.get("action")
-        issue = payload.get("issue")
-        repository = payload.get("repository")
-
-        user = repository["owner"]["login"]
-        repo_name = repository["name"]
-        issue_number = issue["number"]
-
-        if action == "opened" or action == "created":
-            # Fetch issue comments
-            comments = mygitea.get_issue_comments(user, repo_name, issue_number)
-
-            if (
-                len(comments) != 0
-                and comments[-1]["user"]["login"] == config["gitea_username"]
-            ):
-                print("I was the last commenter, skipping...")
-                return jsonify({"status": "skipped"}), 200
-
-            # Generate AI response
-            ai_resp = aihelper.get_response(
-                comments, issue["title"], issue["body"], f"{user}/{repo_name}"
-            )
-            print("Got from AI:", ai_resp)
-
-            # Post comment to the issue
-            mygitea.post_issue_comment(user, repo_name, issue_number, ai_resp)
-            print("Posted response to issue", issue_number, "in", user, repo_name)
-
-    return jsonify({"status": "success"}), 200
+    return intake_webhook(
+        "gitea",
+        clients.gitea(config),
+        config["gitea_username"],
+        event,
+        payload,
+        delivery_id,
+    )
 
 
 ## END GITEA
@@ -130,9 +370,9 @@ def gh_register_repo():
         "events": ["issue", "issue_comment", "pull_request"],
         "active": True,
     }
-    response = mygithub.add_webhook(
+    response = clients.github(config).add_webhook(
         repo_owner, repo_name, webhook_config
-    )  # Use mygithub instead of mygit
+    )
 
     return jsonify(response), 200
 
@@ -141,41 +381,118 @@ def gh_register_repo():
 def gh_handle_webhook():
     payload = request.json
     event = request.headers.get("X-GitHub-Event")
+    delivery_id = request.headers.get("X-GitHub-Delivery")
 
     print("Received event:", event)
 
-    if event == "issues" or event == "issue_comment":
-        action = payload.get("action")
-        issue = payload.get("issue")
-        repository = payload.get("repository")
-
-        user = repository["owner"]["login"]
-        repo_name = repository["name"]
-        issue_number = issue["number"]
-
-        if action == "opened" or action == "created":
-            # Fetch issue comments
-            comments = mygithub.get_issue_comments(user, repo_name, issue_number)
-
-            if (
-                len(comments) != 0
-                and comments[-1]["user"]["login"] == config["github_username"]
-            ):
-                print("I was the last commenter, skipping...")
-                return jsonify({"status": "skipped"}), 200
-
-            # Generate AI response
-            ai_resp = aihelper.get_response(
-                comments, issue["title"], issue["body"], f"{user}/{repo_name}"
-            )
-            print("Got from AI:", ai_resp)
-
-            # Post comment to the issue
-            mygithub.post_issue_comment(user, repo_name, issue_number, ai_resp)
-            print("Posted response to issue", issue_number, "in", user, repo_name)
-
-    return jsonify({"status": "success"}), 200
+    return intake_webhook(
+        "github",
+        clients.github(config),
+        config["github_username"],
+        event,
+        payload,
+        delivery_id,
+    )
+
+
+def run_worker(metrics_port=None):
+    """
+    Runs jobs claimed from the broker on this process's worker pool, forever.
+    Start as many of these as there are cores to spare, on any host that
+    shares the broker.
+
+    Args:
+        metrics_port (int, optional): Where to serve this worker's /metrics.
+            Defaults to worker_metrics_port; 0 turns it off.
+    """
+    if broker is None:
+        raise SystemExit("gort.py worker needs a job_broker, like \"sqlite\"")
+    if metrics_port is None:
+        metrics_port = config.get("worker_metrics_port", 9101)
+    if metrics_port:
+        # Job, run, tool and API metrics are recorded here, not in the front-end
+        metrics.QUEUE_DEPTH.set_function(worker_pool.queue_depth)
+        metrics.JOBS_IN_FLIGHT.set_function(lambda: worker_pool.in_flight)
+        start_http_server(metrics_port, addr=config.get("host", "0.0.0.0"))
+        print("Serving worker metrics on port", metrics_port)
+    poll = config.get("worker_poll", 1)
+    print("Worker", broker.worker, "waiting for jobs")
+    while True:
+        broker.heartbeat()
+        if worker_pool.in_flight + worker_pool.queue_depth() >= worker_pool.size:
+            time.sleep(poll)
+            continue
+        job = broker.claim()
+        if job is None:
+            time.sleep(poll)
+            continue
+        print(f"Claimed job {job['id']} ({job['state']})")
+        worker_pool.submit(run_stored_jobs, [job])
+
+
+def run_workers(processes, metrics_port=None):
+    """
+    Starts processes worker processes and waits for them, stopping them all if
+    one exits or this process is interrupted or terminated. Each serves its
+    metrics on the next port up from metrics_port.
+    """
+    # By default SIGTERM (systemd, docker stop) would kill only this process
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    if metrics_port is None:
+        metrics_port = config.get("worker_metrics_port", 9101)
+    children = [
+        subprocess.Popen(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "worker",
+                "--metrics-port",
+                str(metrics_port + i if metrics_port else 0),
+            ]
+        )
+        for i in range(processes)
+    ]
+    try:
+        while all(child.poll() is None for child in children):
+            time.sleep(1)
+    finally:
+        for child in children:
+            if child.poll() is None:
+                child.terminate()
+        for child in children:
+            child.wait()
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5001)
+    parser = argparse.ArgumentParser(description="Answer issues with an assistant.")
+    parser.add_argument(
+        "mode",
+        nargs="?",
+        default="serve",
+        choices=["serve", "worker"],
+        help="serve webhooks (and run jobs too, unless job_broker is set), or "
+        "run jobs from the broker",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="for worker: how many worker processes to start",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="for worker: port for /metrics (the first of them, with "
+        "--processes), instead of worker_metrics_port; 0 turns it off",
+    )
+    args = parser.parse_args()
+
+    if args.mode == "worker":
+        if args.processes > 1:
+            run_workers(args.processes, args.metrics_port)
+        else:
+            run_worker(args.metrics_port)
+    else:
+        if broker is None:
+            resume_jobs()
+        app.run(host=config.get("host", "0.0.0.0"), port=config.get("port", 5001))
@@ -0,0 +1,104 @@
+# stdlib
+import threading
+from collections import OrderedDict
+
+
+class Intake:
+    def __init__(self, submit, debounce=2.0, remembered_deliveries=10000):
+        """
+        Sits between the webhook routes and the worker pool.
+
+        Drops webhooks whose delivery id was already seen, and coalesces events
+        for the same key (an issue): an event waits debounce seconds, and a newer
+        event for that key in the meantime replaces it. If a job for the key is
+        already running, the newest event waits for it to finish and then runs
+        once, so an issue never has overlapping runs.
+
+        Args:
+            submit (callable): Queues a job, like WorkerPool.submit.
+            debounce (float): Seconds to wait for more events on the same key.
+            remembered_deliveries (int): How many delivery ids to remember.
+        """
+        self.submit = submit
+        self.debounce = debounce
+        self.remembered_deliveries = remembered_deliveries
+        self.seen = OrderedDict()
+        self.pending = {}
+        self.running = set()
+        self.rerun = {}
+        self.lock = threading.Lock()
+
+    def is_duplicate(self, delivery_id):
+        """
+        Records a delivery id and checks whether it was seen before.
+
+        Returns:
+            bool: True if this delivery was already received.
+        """
+        if not delivery_id:
+            return False
+        with self.lock:
+            if delivery_id in self.seen:
+                self.seen.move_to_end(delivery_id)
+                return True
+            self.seen[delivery_id] = True
+            if len(self.seen) > self.remembered_deliveries:
+                self.seen.popitem(last=False)
+            return False
+
+    def add(self, key, func, *args, **kwargs):
+        """
+        Schedules func(*args, **kwargs) for key once the debounce window passes.
+
+        Returns:
+            bool: True if this event replaced one that was still waiting.
+        """
+        job = (func, args, kwargs)
+        with self.lock:
+            replaced = key in self.pending
+            if replaced:
+                self.pending[key][0].cancel()
+            timer = threading.Timer(self.debounce, self._fire, args=(key, job))
+            timer.daemon = True
+            self.pending[key] = (timer, job)
+            timer.start()
+        return replaced
+
+    def start(self, key, func, *args, **kwargs):
+        """
+        Runs func(*args, **kwargs) for key right away, without the debounce.
+
+        Unlike a debounced event, it can't be replaced: events for key that
+        arrive meanwhile wait for it to finish, then run once. Used for jobs
+        picked back up at startup, so key must have nothing running yet.
+        """
+        job = (func, args, kwargs)
+        with self.lock:
+            if key in self.running or key in self.pending:
+                raise RuntimeError(f"{key} already has a job")
+            self.running.add(key)
+        self.submit(self._run, key, job)
+
+    def _fire(self, key, job):
+        with self.lock:
+            # A newer event may have replaced this one just as the timer went off
+            if key not in self.pending or self.pending[key][1] is not job:
+                return
+            del self.pending[key]
+            if key in self.running:
+                self.rerun[key] = job
+                return
+            self.running.add(key)
+        self.submit(self._run, key, job)
+
+    def _run(self, key, job):
+        func, args, kwargs = job
+        try:
+            func(*args, **kwargs)
+        finally:
+            with self.lock:
+                job = self.rerun.pop(key, None)
+                if job is None:
+                    self.running.discard(key)
+            if job is not None:
+                self.submit(self._run, key, job)
@@ -0,0 +1,296 @@
+# stdlib
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+STATES = (
+    "queued",
+    "cloning",
+    "running",
+    "awaiting_tools",
+    "posting",
+    "done",
+    "failed",
+)
+FINISHED_STATES = ("done", "failed")
+FIELDS = ("thread_id", "run_id", "reply", "error")
+
+
+def in_flight(table):
+    """
+    Returns:
+        str: An SQL condition for a job that a worker has picked up and not
+        finished. Jobs run by Intake have no worker, but are past queued.
+    """
+    return (
+        f"{table}.state NOT IN ('done', 'failed') "
+        f"AND ({table}.worker IS NOT NULL OR {table}.state != 'queued')"
+    )
+
+
+# The job the current worker is on, so deep calls can report progress
+_current = contextvars.ContextVar("gort_job", default=None)
+
+
+class JobStore:
+    def __init__(self, path):
+        """
+        Keeps every issue job in SQLite, with its state and the assistant thread
+        and run it's using, so a restart can pick up where a job left off.
+
+        A job moves through queued, cloning, running (and awaiting_tools while
+        its tool calls run), posting, and ends in done or failed.
+
+        The table doubles as a queue for separate worker processes (see claim),
+        so it's opened in WAL mode and writes wait for each other.
+
+        Args:
+            path (str): The SQLite file to keep the jobs in.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "provider TEXT, owner TEXT, repo TEXT, issue INTEGER, "
+                "payload TEXT, delivery_id TEXT, state TEXT, "
+                "thread_id TEXT, run_id TEXT, reply TEXT, error TEXT, "
+                "created_at REAL, updated_at REAL, "
+                "worker TEXT, heartbeat_at REAL)"
+            )
+            # Job tables made before workers could claim jobs
+            columns = {row[1] for row in self.db.execute("PRAGMA table_info(jobs)")}
+            for name, kind in (("worker", "TEXT"), ("heartbeat_at", "REAL")):
+                if name not in columns:
+                    self.db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {kind}")
+            self.db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)")
+            self.db.commit()
+
+    def add(self, provider, owner, repo, issue, delivery_id=None):
+        """
+        Records a new queued job for an issue.
+
+        Args:
+            issue (dict): The issue object from the webhook payload.
+
+        Returns:
+            int: The job's id.
+        """
+        now = time.time()
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT INTO jobs (provider, owner, repo, issue, payload, "
+                "delivery_id, state, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?)",
+                (
+                    provider,
+                    owner,
+                    repo,
+                    issue["number"],
+                    json.dumps(issue),
+                    delivery_id,
+                    now,
+                    now,
+                ),
+            )
+            self.db.commit()
+        return cursor.lastrowid
+
+    def update(self, job_id, state=None, **fields):
+        """
+        Moves a job to state, if given, and records any of thread_id, run_id,
+        reply and error.
+        """
+        if state is not None:
+            if state not in STATES:
+                raise ValueError(f"Unknown job state: {state}")
+            fields["state"] = state
+        for name in fields:
+            if name != "state" and name not in FIELDS:
+                raise ValueError(f"Unknown job field: {name}")
+        if not fields:
+            return
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self.lock:
+            self.db.execute(
+                f"UPDATE jobs SET {columns}, updated_at = ? WHERE id = ?",
+                (*fields.values(), time.time(), job_id),
+            )
+            self.db.commit()
+
+    def supersede(self, job_id):
+        """
+        Marks the issue's older unfinished jobs done. Intake coalesces events on
+        an issue and never runs two jobs for it at once, so whatever those jobs
+        were for is covered by this one.
+        """
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET state = 'done', error = 'superseded', updated_at = ? "
+                "WHERE state NOT IN (?, ?) AND id < ? AND "
+                "(provider, owner, repo, issue) = "
+                "(SELECT provider, owner, repo, issue FROM jobs WHERE id = ?)",
+                (time.time(), *FINISHED_STATES, job_id, job_id),
+            )
+            self.db.commit()
+
+    def claim(self, worker, debounce=2, lease=60):
+        """
+        Atomically hands the next job that's ready to worker. Safe to call from
+        any number of processes sharing the file.
+
+        Jobs whose worker stopped heartbeating for lease seconds come first, so
+        they're resumed. Otherwise it's the newest queued job of an issue that
+        has had no new events for debounce seconds and has no job in flight;
+        its older queued jobs are superseded when it starts. That gives the
+        same coalescing and one-job-per-issue rule as Intake, across processes.
+
+        Returns:
+            dict or None: The claimed job, if one was ready.
+        """
+        now = time.time()
+        same_issue = (
+            "other.provider = jobs.provider AND other.owner = jobs.owner "
+            "AND other.repo = jobs.repo AND other.issue = jobs.issue"
+        )
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.db.execute(
+                    f"SELECT id FROM jobs WHERE {in_flight('jobs')} "
+                    "AND COALESCE(heartbeat_at, 0) < ? ORDER BY id LIMIT 1",
+                    (now - lease,),
+                ).fetchone()
+                if row is None:
+                    row = self.db.execute(
+                        "SELECT id FROM jobs WHERE state = 'queued' "
+                        "AND worker IS NULL AND created_at <= ? "
+                        "AND NOT EXISTS (SELECT 1 FROM jobs AS other WHERE "
+                        f"{same_issue} AND other.id > jobs.id "
+                        "AND other.state = 'queued') "
+                        "AND NOT EXISTS (SELECT 1 FROM jobs AS other WHERE "
+                        f"{same_issue} AND {in_flight('other')}) "
+                        "ORDER BY id LIMIT 1",
+                        (now - debounce,),
+                    ).fetchone()
+                if row is not None:
+                    self.db.execute(
+                        "UPDATE jobs SET worker = ?, heartbeat_at = ? WHERE id = ?",
+                        (worker, now, row[0]),
+                    )
+                self.db.commit()
+            except BaseException:
+                self.db.rollback()
+                raise
+        return None if row is None else self.get(row[0])
+
+    def heartbeat(self, worker):
+        """
+        Renews the lease on worker's unfinished jobs.
+        """
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET heartbeat_at = ? "
+                "WHERE worker = ? AND state NOT IN (?, ?)",
+                (time.time(), worker, *FINISHED_STATES),
+            )
+            self.db.commit()
+
+    def count_waiting(self):
+        """
+        Returns:
+            int: Issues with a queued job that no worker has claimed yet.
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT COUNT(*) FROM (SELECT DISTINCT provider, owner, repo, issue "
+                "FROM jobs WHERE state = 'queued' AND worker IS NULL)"
+            ).fetchone()
+        return row[0]
+
+    def count_in_flight(self):
+        """
+        Returns:
+            int: Jobs a worker has picked up and not finished.
+        """
+        with self.lock:
+            row = self.db.execute(
+                f"SELECT COUNT(*) FROM jobs WHERE {in_flight('jobs')}"
+            ).fetchone()
+        return row[0]
+
+    def get(self, job_id):
+        """
+        Returns:
+            dict or None: The job, with its issue payload decoded.
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self.decode(row)
+
+    def unfinished(self):
+        """
+        Returns:
+            list: Jobs that haven't reached done or failed, oldest first.
+        """
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM jobs WHERE state NOT IN (?, ?) ORDER BY id",
+                FINISHED_STATES,
+            ).fetchall()
+        return [self.decode(row) for row in rows]
+
+    @staticmethod
+    def decode(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job["issue"] = json.loads(job.pop("payload"))
+        return job
+
+
+@contextmanager
+def track(store, job_id):
+    """
+    Makes job_id the current job for update() while the block runs. Like
+    tracing, it follows the job into tool threads started with tracing.submit.
+    """
+    token = _current.set((store, job_id))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def current():
+    """
+    Returns:
+        dict or None: The current job, if there is one.
+    """
+    tracked = _current.get()
+    if tracked is None:
+        return None
+    store, job_id = tracked
+    return store.get(job_id)
+
+
+def update(state=None, **fields):
+    """
+    Updates the current job, if there is one. See JobStore.update.
+    """
+    tracked = _current.get()
+    if tracked is None:
+        return
+    store, job_id = tracked
+    store.update(job_id, state, **fields)
@@ -0,0 +1,78 @@
+# pip
+from prometheus_client import Counter, Gauge, Histogram
+
+# Buckets for things that take from milliseconds (API calls) to minutes (runs)
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+WEBHOOKS = Counter(
+    "gort_webhooks_total", "Webhooks received, by outcome", ["provider", "status"]
+)
+WEBHOOK_SECONDS = Histogram(
+    "gort_webhook_intake_seconds",
+    "Time to validate and queue a webhook",
+    ["provider"],
+    buckets=BUCKETS,
+)
+JOB_SECONDS = Histogram(
+    "gort_job_seconds",
+    "Time from a worker picking up an issue to posting the reply",
+    ["provider"],
+    buckets=BUCKETS,
+)
+QUEUE_DEPTH = Gauge("gort_queue_depth", "Jobs waiting for a worker")
+JOBS_IN_FLIGHT = Gauge("gort_jobs_in_flight", "Jobs being worked on")
+
+WORKSPACE_SECONDS = Histogram(
+    "gort_workspace_seconds",
+    "Time spent preparing workspaces, by git operation",
+    ["operation"],
+    buckets=BUCKETS,
+)
+THREAD_SETUP_SECONDS = Histogram(
+    "gort_thread_setup_seconds",
+    "Time to create or look up an issue's assistant thread",
+    ["kind"],
+    buckets=BUCKETS,
+)
+RUN_WAIT_SECONDS = Histogram(
+    "gort_run_wait_seconds",
+    "Time waiting on the model between starting a run or submitting tool outputs "
+    "and the next tool call or the end of the run",
+    ["mode"],
+    buckets=BUCKETS,
+)
+RUN_POLL_SECONDS = Histogram(
+    "gort_run_poll_seconds", "Latency of each runs.retrieve poll", buckets=BUCKETS
+)
+RUNS = Counter("gort_runs_total", "Finished runs, by final status", ["status"])
+TOOL_SECONDS = Histogram(
+    "gort_tool_call_seconds", "Time to run each tool call", ["tool"], buckets=BUCKETS
+)
+TOOL_CACHE = Counter(
+    "gort_tool_cache_total", "Read-only tool call cache lookups", ["result"]
+)
+API_SECONDS = Histogram(
+    "gort_api_call_seconds",
+    "Latency of GitHubApi/GiteaApi methods",
+    ["client", "method"],
+    buckets=BUCKETS,
+)
+
+
+def instrument_client(name):
+    """
+    Class decorator that times every public method of an API client into
+    API_SECONDS, labelled with name and the method name.
+
+    Generator methods (iter_*) are left alone, since their work happens lazily.
+    """
+
+    def decorate(cls):
+        for attr, value in list(vars(cls).items()):
+            if attr.startswith("_") or attr.startswith("iter_") or not callable(value):
+                continue
+            setattr(cls, attr, API_SECONDS.labels(name, attr).time()(value))
+        return cls
+
+    return decorate
+
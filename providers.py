@@ -0,0 +1,520 @@
+# stdlib
+import asyncio
+import hashlib
+import threading
+
+# pip
+import httpx
+
+# local
+from ratelimit import RateLimiter
+from responsecache import ResponseCache
+
+_providers = {}
+_providers_lock = threading.Lock()
+_cache = None
+_loop = None
+_loop_lock = threading.Lock()
+
+# Headers that describe the bytes on the wire, not the decoded body we cache
+WIRE_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+# Safe to send again after a connection error, since a repeat has no extra effect
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+
+class ApiError(Exception):
+    def __init__(self, response):
+        """
+        Raised while paginating when a page isn't a JSON list.
+
+        Args:
+            response (httpx.Response): The response for the bad page.
+        """
+        self.text = response.text
+        try:
+            self.body = response.json()
+        except ValueError:
+            self.body = {"msg": response.text}
+        super().__init__(f"{response.status_code}: {self.body}")
+
+
+def get_loop():
+    """
+    Returns the event loop all provider I/O runs on, starting its thread if needed.
+    """
+    global _loop
+
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="gort-io", daemon=True
+            ).start()
+        return _loop
+
+
+def run(coro):
+    """
+    Runs a coroutine on the shared event loop and waits for its result.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+
+def iterate(agen):
+    """
+    Turns an async generator into a blocking one, driving it on the shared loop.
+    """
+    try:
+        while True:
+            try:
+                yield run(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        run(agen.aclose())
+
+
+def json_or_error(response):
+    try:
+        return response.json()
+    except ValueError:
+        return {"msg": response.text}
+
+
+class AsyncProvider:
+    # Subclasses set these
+    name = None
+    page_size_param = None
+    max_per_page = None
+    # The field holding a user's or organization's name
+    name_field = None
+
+    def __init__(
+        self,
+        api_url,
+        headers,
+        pool_size=20,
+        concurrency=16,
+        retries=3,
+        backoff=0.5,
+        timeout=30,
+        cache=None,
+        limiter=None,
+        rate_limit_retries=3,
+    ):
+        """
+        An asyncio client for a forge's REST API.
+
+        Every job's API calls share one connection pool on one event loop, so
+        waiting on the network doesn't hold a thread each. At most concurrency
+        requests are in flight at once.
+
+        Connection errors are retried, and so are 5xx responses to idempotent
+        requests, with exponential backoff. A POST is never re-sent after it
+        reached the server, so a comment can't get posted twice.
+
+        Args:
+            api_url (str): The API root, like https://api.github.com.
+            headers (dict): Headers sent with every request.
+            pool_size (int): The maximum number of connections kept open.
+            concurrency (int): The maximum number of requests in flight.
+            retries (int): How many times to retry a failed request.
+            backoff (float): The backoff factor between retries, in seconds.
+            timeout (float): The timeout for each request, in seconds.
+            cache (ResponseCache, optional): Where to keep GET responses for
+                conditional requests.
+            limiter (RateLimiter, optional): Paces requests and holds them back
+                when the rate limit runs low.
+            rate_limit_retries (int): How many times to retry a request that was
+                rate limited, after waiting as long as the server asked.
+        """
+        self.api_url = api_url.rstrip("/")
+        self.headers = headers
+        self.pool_size = pool_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache = cache
+        self.limiter = limiter
+        self.rate_limit_retries = rate_limit_retries
+        # Responses depend on whose token asked, so cache keys are per token
+        auth = headers.get("Authorization", "")
+        self.cache_prefix = hashlib.sha256(auth.encode("utf-8")).hexdigest()[:16]
+        self.client = None
+        self.slots = None
+
+    def connect(self):
+        # Created on first use, from the loop thread, so they belong to that loop
+        if self.client is None:
+            # The client ignores limits= when given a transport, so they go here.
+            # Retries are left to limited_request, which also backs off.
+            self.client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=self.timeout,
+                transport=httpx.AsyncHTTPTransport(
+                    limits=httpx.Limits(
+                        max_connections=self.pool_size,
+                        max_keepalive_connections=self.pool_size,
+                    )
+                ),
+            )
+            self.slots = asyncio.Semaphore(self.concurrency)
+        return self.client
+
+    async def request(self, method, url, **kwargs):
+        """
+        Sends a request, answering GETs from the cache when the server says
+        they're unchanged.
+
+        Returns:
+            httpx.Response: The response.
+        """
+        if method.upper() != "GET" or self.cache is None:
+            return await self.limited_request(method, url, **kwargs)
+        return await self.conditional_get(url, **kwargs)
+
+    async def limited_request(self, method, url, **kwargs):
+        """
+        Sends a request once the rate limiter allows it, retrying after the
+        server's Retry-After (or the quota reset) when it's rate limited.
+
+        Connection errors (a reset keep-alive connection, a read timeout) are
+        retried with backoff for idempotent methods. Other requests are only
+        retried when the connection was never made, so a comment isn't posted
+        twice.
+        """
+        client = self.connect()
+        write = method.upper() not in ("GET", "HEAD")
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                await self.limiter.acquire(write)
+            try:
+                async with self.slots:
+                    response = await client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                safe = method.upper() in IDEMPOTENT_METHODS or isinstance(
+                    e, (httpx.ConnectError, httpx.ConnectTimeout)
+                )
+                if not safe or attempt >= self.retries:
+                    raise
+                delay = self.backoff * 2**attempt
+                attempt += 1
+                print(f"Retrying {method} {url} in {delay:.1f}s ({e!r})")
+                await asyncio.sleep(delay)
+                continue
+
+            delay = self.limiter.update(response) if self.limiter else None
+            retries = self.rate_limit_retries
+            if delay is None and response.status_code >= 500 and not write:
+                delay = self.backoff * 2**attempt
+                retries = self.retries
+            if delay is None or attempt >= retries:
+                return response
+            attempt += 1
+            print(f"Retrying {method} {url} in {delay:.1f}s ({response.status_code})")
+            await asyncio.sleep(delay)
+
+    async def conditional_get(self, url, **kwargs):
+        """
+        Sends a GET with If-None-Match/If-Modified-Since when the response is cached.
+
+        A 304 is answered from the cache (GitHub doesn't count it against the rate
+        limit); a 200 with an ETag or Last-Modified header refreshes the cache.
+        """
+        request = httpx.Request("GET", url, params=kwargs.get("params"))
+        key = f"{self.cache_prefix} {request.url}"
+        entry = self.cache.get(key)
+
+        if entry is not None:
+            headers = dict(kwargs.pop("headers", None) or {})
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+            kwargs["headers"] = headers
+
+        response = await self.limited_request("GET", url, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            headers = httpx.Headers(entry["headers"])
+            # Keep fresh rate-limit and date headers from the 304
+            headers.update(response.headers)
+            for name in WIRE_HEADERS:
+                headers.pop(name, None)
+            return httpx.Response(
+                200,
+                headers=headers,
+                content=entry["content"],
+                request=response.request,
+            )
+
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if response.status_code == 200 and (etag or last_modified):
+            headers = {
+                k: v
+                for k, v in response.headers.items()
+                if k.lower() not in WIRE_HEADERS
+            }
+            self.cache.put(key, etag, last_modified, headers, response.content)
+        return response
+
+    async def get_page(self, url, params=None):
+        response = await self.request("GET", url, params=params)
+        try:
+            items = response.json()
+        except ValueError:
+            raise ApiError(response)
+        if not isinstance(items, list):
+            raise ApiError(response)
+        return response, items
+
+    async def paginate(self, url, params=None, reverse=False):
+        """
+        Lazily yields every item of a paginated list endpoint, following Link headers.
+
+        Pages are only fetched as the caller iterates, so breaking out early skips
+        the remaining requests.
+
+        Args:
+            url (str): The URL of the first page.
+            params (dict, optional): Query parameters for the first page, e.g. per_page.
+            reverse (bool): Yield items last to first, by jumping to the
+                last page and following prev links. Useful for "last N" reads.
+
+        Yields:
+            dict: Each item in the list.
+
+        Raises:
+            ApiError: If a page isn't a JSON list.
+        """
+        response, items = await self.get_page(url, params)
+
+        if reverse:
+            if "last" in response.links:
+                response, items = await self.get_page(response.links["last"]["url"])
+            while True:
+                for item in reversed(items):
+                    yield item
+                if "prev" not in response.links:
+                    return
+                response, items = await self.get_page(response.links["prev"]["url"])
+
+        while True:
+            for item in items:
+                yield item
+            if "next" not in response.links:
+                return
+            response, items = await self.get_page(response.links["next"]["url"])
+
+    async def collect(self, pages):
+        """
+        Returns:
+            list or dict: Every item, or the error response if a page failed.
+        """
+        try:
+            return [item async for item in pages]
+        except ApiError as e:
+            return e.body
+
+    def page_params(self, bulk):
+        return {self.page_size_param: self.max_per_page} if bulk else None
+
+    def url(self, path):
+        return f"{self.api_url}{path}"
+
+    async def add_webhook(self, owner, repo, config):
+        response = await self.request(
+            "POST", self.url(f"/repos/{owner}/{repo}/hooks"), json=config
+        )
+        return response.json()
+
+    async def get_user_orgs(self, username):
+        """
+        Returns:
+            list: The names of the organizations username belongs to.
+        """
+        pages = self.paginate(
+            self.url(f"/users/{username}/orgs"), self.page_params(True)
+        )
+        try:
+            return [org[self.name_field] async for org in pages]
+        except ApiError as e:
+            return [e.text]
+
+    def iter_user_repos(self, username, bulk=False):
+        return self.paginate(
+            self.url(f"/users/{username}/repos"), self.page_params(bulk)
+        )
+
+    async def get_user_repos(self, username):
+        return await self.collect(self.iter_user_repos(username, bulk=True))
+
+    def iter_issues(self, owner, repo, bulk=False):
+        return self.paginate(
+            self.url(f"/repos/{owner}/{repo}/issues"), self.page_params(bulk)
+        )
+
+    async def get_issues(self, owner, repo):
+        return await self.collect(self.iter_issues(owner, repo, bulk=True))
+
+    async def get_issue(self, owner, repo, issue_number):
+        response = await self.request(
+            "GET", self.url(f"/repos/{owner}/{repo}/issues/{issue_number}")
+        )
+        return json_or_error(response)
+
+    def iter_issue_comments(self, owner, repo, issue_number, bulk=False, reverse=False):
+        return self.paginate(
+            self.url(f"/repos/{owner}/{repo}/issues/{issue_number}/comments"),
+            self.page_params(bulk),
+            reverse=reverse,
+        )
+
+    async def get_issue_comments(self, owner, repo, issue_number, last=None):
+        """
+        Returns:
+            list or dict: The issue's comments oldest first (only the newest
+            `last` of them, if given), or the error response.
+        """
+        if last is None:
+            return await self.collect(
+                self.iter_issue_comments(owner, repo, issue_number, bulk=True)
+            )
+        newest = self.iter_issue_comments(
+            owner, repo, issue_number, bulk=True, reverse=True
+        )
+        comments = []
+        try:
+            async for comment in newest:
+                comments.append(comment)
+                if len(comments) >= last:
+                    break
+        except ApiError as e:
+            return e.body
+        finally:
+            await newest.aclose()
+        return comments[::-1]
+
+    async def post_issue_comment(self, owner, repo, issue_number, comment):
+        response = await self.request(
+            "POST",
+            self.url(f"/repos/{owner}/{repo}/issues/{issue_number}/comments"),
+            json={"body": comment},
+        )
+        return response.json()
+
+    async def get_repo(self, owner, repo):
+        response = await self.request("GET", self.url(f"/repos/{owner}/{repo}"))
+        return json_or_error(response)
+
+    async def fork_repo(self, owner, repo):
+        response = await self.request(
+            "POST", self.url(f"/repos/{owner}/{repo}/forks"), json={"name": repo}
+        )
+        return json_or_error(response)
+
+    async def create_pull_request(
+        self, owner, repo, title, body, head_branch, base_branch
+    ):
+        response = await self.request(
+            "POST",
+            self.url(f"/repos/{owner}/{repo}/pulls"),
+            json={
+                "title": title,
+                "body": body,
+                "head": head_branch,
+                "base": base_branch,
+            },
+        )
+        return json_or_error(response)
+
+
+class GitHubProvider(AsyncProvider):
+    name = "github"
+    page_size_param = "per_page"
+    # GitHub caps per_page at 100
+    max_per_page = 100
+    name_field = "login"
+
+    async def get_users(self):
+        return ["SomethingGeneric"]
+
+    def iter_prs(self, owner, repo, bulk=False):
+        return self.paginate(
+            self.url(f"/repos/{owner}/{repo}/pulls"), self.page_params(bulk)
+        )
+
+    async def get_prs(self, owner, repo):
+        return await self.collect(self.iter_prs(owner, repo, bulk=True))
+
+
+class GiteaProvider(AsyncProvider):
+    name = "gitea"
+    page_size_param = "limit"
+    # Gitea's default MAX_RESPONSE_ITEMS
+    max_per_page = 50
+    name_field = "username"
+
+    async def get_users(self):
+        pages = self.paginate(self.url("/admin/users"), self.page_params(True))
+        try:
+            return [user["username"] async for user in pages]
+        except ApiError as e:
+            return [e.text]
+
+    def iter_prs(self, repo, bulk=False):
+        return self.paginate(self.url(f"/repos/{repo}/pulls"), self.page_params(bulk))
+
+    async def get_prs(self, repo):
+        return await self.collect(self.iter_prs(repo, bulk=True))
+
+
+def get_provider(cls, config, api_url, headers):
+    """
+    Returns the process-wide provider client for an API and set of credentials,
+    creating it if needed.
+
+    Every client built with the same URL and headers shares one connection pool
+    and one rate limiter, and all of them share the response cache.
+
+    Args:
+        cls (type): GitHubProvider or GiteaProvider.
+        config (dict): The bot config, for the http_* settings.
+        api_url (str): The API root.
+        headers (dict): Headers sent with every request, including the token.
+
+    Returns:
+        AsyncProvider: The shared client.
+    """
+    global _cache
+
+    key = (cls, api_url, tuple(sorted(headers.items())))
+    with _providers_lock:
+        if _cache is None and config.get("http_cache_mb", 64) > 0:
+            _cache = ResponseCache(
+                config.get("http_cache_mb", 64) * 1024 * 1024,
+                path=config.get("http_cache_path"),
+                max_disk_bytes=config.get("http_cache_disk_mb", 256) * 1024 * 1024,
+            )
+        if key not in _providers:
+            _providers[key] = cls(
+                api_url,
+                headers,
+                pool_size=config.get("http_pool_size", 20),
+                concurrency=config.get("http_concurrency", 16),
+                retries=config.get("http_retries", 3),
+                backoff=config.get("http_backoff", 0.5),
+                timeout=config.get("http_timeout", 30),
+                cache=_cache,
+                limiter=RateLimiter(
+                    rate=config.get("http_rate", 10),
+                    burst=config.get("http_burst", 20),
+                    reserve=config.get("http_rate_reserve", 100),
+                    max_wait=config.get("http_rate_max_wait", 900),
+                ),
+                rate_limit_retries=config.get("http_rate_retries", 3),
+            )
+        return _providers[key]
@@ -0,0 +1,145 @@
+# stdlib
+import asyncio
+import email.utils
+import threading
+import time
+
+
+def parse_retry_after(value):
+    """
+    Returns:
+        float or None: Seconds to wait, from a Retry-After header in either
+        delta-seconds or HTTP date form.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class RateLimiter:
+    def __init__(self, rate=10, burst=20, reserve=100, max_wait=900):
+        """
+        Paces the requests made with one token.
+
+        A token bucket spreads requests out to rate per second. Quota is tracked
+        from X-RateLimit-Remaining/X-RateLimit-Reset and Retry-After response
+        headers: when the quota runs out, or the server asks us to back off,
+        requests wait instead of failing.
+
+        Writes (comments, pull requests) go first: reads wait while any write is
+        waiting, and stop once only reserve requests of quota are left, so the
+        quota that's left goes to things users see.
+
+        Args:
+            rate (float): Requests per second the bucket refills at.
+            burst (int): How many requests can go at once after a quiet spell.
+            reserve (int): Quota kept back for writes.
+            max_wait (float): The longest a request will wait for quota, in seconds.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self.tokens = burst
+        self.refilled_at = time.monotonic()
+        self.remaining = None
+        self.reset_at = 0
+        self.blocked_until = 0
+        self.writes_waiting = 0
+        self.lock = threading.Lock()
+
+    def reserve_slot(self, write=False):
+        """
+        Takes a slot for a request if one is free, without blocking.
+
+        Returns:
+            float: 0 if the request can go now, otherwise how long to wait
+            before asking again.
+        """
+        with self.lock:
+            now = time.time()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+
+            if self.remaining is not None and now < self.reset_at:
+                floor = 0 if write else self.reserve
+                if self.remaining <= floor:
+                    return self.reset_at - now
+            if not write and self.writes_waiting:
+                return 0.05
+
+            clock = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (clock - self.refilled_at) * self.rate
+            )
+            self.refilled_at = clock
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+            if self.remaining is not None:
+                self.remaining -= 1
+            return 0
+
+    async def acquire(self, write=False):
+        """
+        Waits until the request can be sent, without blocking the event loop.
+        """
+        if write:
+            with self.lock:
+                self.writes_waiting += 1
+        try:
+            while True:
+                delay = self.reserve_slot(write)
+                if delay <= 0:
+                    return
+                await asyncio.sleep(min(delay, self.max_wait))
+        finally:
+            if write:
+                with self.lock:
+                    self.writes_waiting -= 1
+
+    def update(self, response):
+        """
+        Records the quota a response reports.
+
+        Returns:
+            float or None: How long to wait before retrying, if the response
+            was a rate limit (429, or 403 with no quota left or a Retry-After).
+        """
+        headers = response.headers
+        retry_after = parse_retry_after(headers.get("Retry-After"))
+        with self.lock:
+            now = time.time()
+            try:
+                remaining = int(headers["X-RateLimit-Remaining"])
+                reset_at = float(headers["X-RateLimit-Reset"])
+            except (KeyError, ValueError):
+                remaining = None
+            if remaining is not None:
+                self.remaining = remaining
+                self.reset_at = reset_at
+
+            limited = response.status_code == 429 or (
+                response.status_code == 403
+                and (retry_after is not None or remaining == 0)
+            )
+            if not limited:
+                return None
+
+            if retry_after is None:
+                if remaining == 0 and self.reset_at > now:
+                    retry_after = self.reset_at - now
+                else:
+                    # Secondary limits without a Retry-After: wait at least a minute
+                    retry_after = 60
+            retry_after = min(retry_after, self.max_wait)
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+            return retry_after
@@ -0,0 +1,212 @@
+# stdlib
+import ast
+import json
+import os
+import re
+import subprocess
+import threading
+from collections import Counter
+
+LANGUAGES = {
+    ".py": "Python",
+    ".js": "JavaScript",
+    ".jsx": "JavaScript",
+    ".mjs": "JavaScript",
+    ".ts": "TypeScript",
+    ".tsx": "TypeScript",
+    ".go": "Go",
+    ".rs": "Rust",
+    ".java": "Java",
+    ".kt": "Kotlin",
+    ".cs": "C#",
+    ".rb": "Ruby",
+    ".php": "PHP",
+    ".c": "C",
+    ".h": "C",
+    ".cpp": "C++",
+    ".cc": "C++",
+    ".hpp": "C++",
+    ".swift": "Swift",
+    ".sh": "Shell",
+    ".html": "HTML",
+    ".css": "CSS",
+    ".scss": "CSS",
+    ".md": "Markdown",
+    ".toml": "TOML",
+    ".yml": "YAML",
+    ".yaml": "YAML",
+    ".json": "JSON",
+}
+
+# Top-level definitions, for languages without a parser in the stdlib
+SYMBOL_PATTERNS = {
+    "JavaScript": r"^(?:export\s+)?(?:default\s+)?(?:async\s+)?(?:function\*?|class)\s+(\w+)|^(?:export\s+)?const\s+(\w+)\s*=",
+    "TypeScript": r"^(?:export\s+)?(?:default\s+)?(?:async\s+)?(?:function\*?|class|interface|type|enum)\s+(\w+)|^(?:export\s+)?const\s+(\w+)\s*=",
+    "Go": r"^func\s+(?:\([^)]*\)\s*)?(\w+)|^type\s+(\w+)",
+    "Rust": r"^(?:pub(?:\([^)]*\))?\s+)?(?:async\s+)?(?:fn|struct|enum|trait|mod|type)\s+(\w+)",
+    "Java": r"^(?:public\s+|abstract\s+|final\s+)*(?:class|interface|enum|record)\s+(\w+)",
+    "Kotlin": r"^(?:\w+\s+)*(?:class|interface|object|fun)\s+(\w+)",
+    "C#": r"^\s*(?:public\s+|internal\s+|static\s+|abstract\s+|sealed\s+|partial\s+)*(?:class|interface|enum|struct|record)\s+(\w+)",
+    "Ruby": r"^(?:class|module|def)\s+([\w.]+)",
+    "PHP": r"^(?:abstract\s+|final\s+)?(?:class|interface|trait|function)\s+(\w+)",
+    "Swift": r"^(?:public\s+|open\s+|final\s+)*(?:class|struct|enum|protocol|func)\s+(\w+)",
+    "Shell": r"^(?:function\s+)?(\w+)\s*\(\)\s*\{",
+}
+
+# Files bigger than this are listed but not scanned for symbols
+MAX_SCAN_BYTES = 256 * 1024
+MAX_SYMBOLS_PER_FILE = 20
+
+
+def python_symbols(source):
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return []
+    return [
+        node.name
+        for node in tree.body
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+    ]
+
+
+def file_symbols(path, language):
+    if language != "Python" and language not in SYMBOL_PATTERNS:
+        return []
+    try:
+        if os.path.getsize(path) > MAX_SCAN_BYTES:
+            return []
+        with open(path, encoding="utf-8", errors="replace") as f:
+            source = f.read()
+    except OSError:
+        return []
+
+    if language == "Python":
+        symbols = python_symbols(source)
+    else:
+        symbols = []
+        for match in re.finditer(SYMBOL_PATTERNS[language], source, re.MULTILINE):
+            symbols.append(next(g for g in match.groups() if g))
+    return symbols[:MAX_SYMBOLS_PER_FILE]
+
+
+def build_index(path):
+    """
+    Indexes the files git tracks in a checkout.
+
+    Args:
+        path (str): The checkout.
+
+    Returns:
+        dict: The HEAD commit and, for each file, its size, language and top-level symbols.
+    """
+    commit = subprocess.run(
+        ["git", "rev-parse", "HEAD"], cwd=path, capture_output=True, text=True
+    ).stdout.strip()
+    listing = subprocess.run(
+        ["git", "ls-files", "-z"], cwd=path, capture_output=True, text=True
+    ).stdout
+
+    files = []
+    for name in sorted(filter(None, listing.split("\0"))):
+        full = os.path.join(path, name)
+        try:
+            size = os.path.getsize(full)
+        except OSError:
+            continue
+        language = LANGUAGES.get(os.path.splitext(name)[1].lower())
+        files.append(
+            {
+                "path": name,
+                "size": size,
+                "language": language,
+                "symbols": file_symbols(full, language),
+            }
+        )
+    return {"commit": commit, "files": files}
+
+
+def summarize(index, max_chars):
+    """
+    Renders an index as a compact text overview, cut off at max_chars.
+
+    Returns:
+        str: Languages by size, then one line per file with its size and symbols.
+    """
+    languages = Counter()
+    for entry in index["files"]:
+        if entry["language"]:
+            languages[entry["language"]] += entry["size"]
+
+    lines = [
+        f"Repository overview at commit {index['commit'][:12]} "
+        f"({len(index['files'])} tracked files).",
+    ]
+    if languages:
+        sizes = [f"{lang} {size // 1024}KB" for lang, size in languages.most_common()]
+        lines.append("Languages by size: " + ", ".join(sizes))
+    lines.append("Files (size in bytes, top-level symbols):")
+
+    used = sum(len(line) + 1 for line in lines)
+    for i, entry in enumerate(index["files"]):
+        line = f"{entry['path']} {entry['size']}"
+        if entry["symbols"]:
+            line += ": " + ", ".join(entry["symbols"])
+        if used + len(line) + 1 > max_chars:
+            lines.append(f"... and {len(index['files']) - i} more files")
+            break
+        lines.append(line)
+        used += len(line) + 1
+    return "\n".join(lines)
+
+
+class RepoIndexer:
+    def __init__(self, cache_dir, max_chars=6000):
+        """
+        Builds repo overviews for the assistant, cached on disk by commit.
+
+        Args:
+            cache_dir (str): Where to keep one JSON index per repo and commit.
+            max_chars (int): The size cap for a summary.
+        """
+        self.cache_dir = cache_dir
+        self.max_chars = max_chars
+
+    def summary(self, repo, path, save=True):
+        """
+        Returns a compact overview of the checkout at path, reusing the cached
+        index when HEAD hasn't changed.
+
+        Args:
+            repo (str): The repository name, to keep each repo's cache apart.
+            path (str): The checkout.
+            save (bool): Cache a freshly built index. Off for sparse checkouts,
+                whose index only covers part of the tree.
+
+        Returns:
+            str: The overview.
+        """
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=path, capture_output=True, text=True
+        ).stdout.strip()
+        cache = os.path.join(self.cache_dir, repo, f"{commit}.json")
+
+        index = None
+        if commit and os.path.exists(cache):
+            try:
+                with open(cache) as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                index = None
+
+        if index is None:
+            print(f"Indexing {repo} at {commit[:12]}")
+            index = build_index(path)
+            if commit and save:
+                os.makedirs(os.path.dirname(cache), exist_ok=True)
+                tmp = f"{cache}.{os.getpid()}-{threading.get_ident()}.tmp"
+                with open(tmp, "w") as f:
+                    json.dump(index, f)
+                os.replace(tmp, cache)
+
+        return summarize(index, self.max_chars)
@@ -0,0 +1,113 @@
+# stdlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    def __init__(self, max_bytes, path=None, max_disk_bytes=None):
+        """
+        An LRU cache of API responses, keyed by URL, for conditional requests.
+
+        Entries hold the body along with the ETag/Last-Modified validators so a 304
+        can be answered locally. Memory use is capped at max_bytes of bodies.
+        With a path, entries are also written to a SQLite file and survive
+        restarts; the file is capped at max_disk_bytes.
+
+        Args:
+            max_bytes (int): The memory budget for cached bodies.
+            path (str, optional): A SQLite file to back the cache with.
+            max_disk_bytes (int, optional): The budget for the file. Defaults to max_bytes.
+        """
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes or max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.db = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, entry TEXT, size INTEGER, used REAL)"
+            )
+            self.db.commit()
+
+    def get(self, key):
+        """
+        Returns:
+            dict or None: The cached entry for key, with etag, last_modified,
+            headers and content.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            if self.db is None:
+                return None
+            row = self.db.execute(
+                "SELECT entry FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.db.execute(
+                "UPDATE responses SET used = ? WHERE key = ?", (time.time(), key)
+            )
+            self.db.commit()
+            entry = json.loads(row[0])
+            entry["content"] = entry["content"].encode("utf-8")
+            self._remember(key, entry)
+            return entry
+
+    def put(self, key, etag, last_modified, headers, content):
+        entry = {
+            "etag": etag,
+            "last_modified": last_modified,
+            "headers": dict(headers),
+            "content": content,
+        }
+        with self.lock:
+            self._remember(key, entry)
+            if self.db is None:
+                return
+            try:
+                text = content.decode("utf-8")
+            except UnicodeDecodeError:
+                return
+            stored = json.dumps(dict(entry, content=text))
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, stored, len(stored), time.time()),
+            )
+            self._prune_disk()
+            self.db.commit()
+
+    def _remember(self, key, entry):
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key)["content"])
+        if len(entry["content"]) > self.max_bytes:
+            return
+        self.entries[key] = entry
+        self.size += len(entry["content"])
+        while self.size > self.max_bytes:
+            _, old = self.entries.popitem(last=False)
+            self.size -= len(old["content"])
+
+    def _prune_disk(self):
+        (total,) = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if total <= self.max_disk_bytes:
+            return
+        for key, size in self.db.execute(
+            "SELECT key, size FROM responses ORDER BY used"
+        ).fetchall():
+            if total <= self.max_disk_bytes:
+                break
+            self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
@@ -0,0 +1,65 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiutils import is_read_only_command
+
+READ_ONLY = [
+    "cat README.md",
+    "ls -la src",
+    "grep -rn foo . | head -20",
+    "sort -u names.txt",
+    "sort -k2 -t, data.csv",
+    "uniq names.txt",
+    "uniq - ",
+    "rg --pretty foo",
+    "grep -o foo file",
+    "find . -name '*.py'",
+    "cat missing 2> /dev/null",
+    "file setup.py",
+]
+
+WRITES = [
+    "cat a\nrm b",
+    "cat a\rrm b",
+    "ls; rm -rf .",
+    "cat a > b",
+    "echo $(rm b)",
+    "echo `rm b`",
+    "sort -o out in",
+    "sort -ofile in",
+    "sort -uo file in",
+    "sort --output=out in",
+    "sort --out=out in",
+    "sort --compress-program=sh in",
+    "sort --compress-program sh in",
+    "uniq in out",
+    "uniq - out",
+    "find . -delete",
+    "find . -exec rm {} ;",
+    "tree -o out",
+    "rg --pre=sh foo",
+    "rg --pre sh foo",
+    "file -C -m magic",
+    "file --compile -m magic",
+    "python -c 1",
+    "cat a & rm b",
+]
+
+
+class ReadOnlyCommandTest(unittest.TestCase):
+    def test_read_only(self):
+        for command in READ_ONLY:
+            with self.subTest(command=command):
+                self.assertTrue(is_read_only_command(command))
+
+    def test_writes(self):
+        for command in WRITES:
+            with self.subTest(command=command):
+                self.assertFalse(is_read_only_command(command))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+# stdlib
+import os
+import sqlite3
+import threading
+
+
+class ThreadStore:
+    def __init__(self, path):
+        """
+        Remembers which assistant thread belongs to each issue, and which of the
+        issue's comments have already been copied into it.
+
+        Args:
+            path (str): The SQLite file to keep the mapping in.
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS threads ("
+                "provider TEXT, repo TEXT, issue INTEGER, thread_id TEXT, "
+                "PRIMARY KEY (provider, repo, issue))"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS synced_comments ("
+                "thread_id TEXT, comment_id INTEGER, "
+                "PRIMARY KEY (thread_id, comment_id))"
+            )
+            self.db.commit()
+
+    def get_thread(self, provider, repo_slug, issue_number):
+        """
+        Returns:
+            str or None: The thread id for the issue, if it has one.
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT thread_id FROM threads WHERE provider = ? AND repo = ? AND issue = ?",
+                (provider, repo_slug, issue_number),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_thread(self, provider, repo_slug, issue_number, thread_id):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO threads VALUES (?, ?, ?, ?)",
+                (provider, repo_slug, issue_number, thread_id),
+            )
+            self.db.commit()
+
+    def forget_thread(self, provider, repo_slug, issue_number):
+        with self.lock:
+            self.db.execute(
+                "DELETE FROM synced_comments WHERE thread_id IN ("
+                "SELECT thread_id FROM threads WHERE provider = ? AND repo = ? AND issue = ?)",
+                (provider, repo_slug, issue_number),
+            )
+            self.db.execute(
+                "DELETE FROM threads WHERE provider = ? AND repo = ? AND issue = ?",
+                (provider, repo_slug, issue_number),
+            )
+            self.db.commit()
+
+    def synced_comments(self, thread_id):
+        """
+        Returns:
+            set: The ids of comments already added to the thread.
+        """
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT comment_id FROM synced_comments WHERE thread_id = ?",
+                (thread_id,),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def mark_synced(self, thread_id, comment_ids):
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO synced_comments VALUES (?, ?)",
+                [(thread_id, comment_id) for comment_id in comment_ids],
+            )
+            self.db.commit()
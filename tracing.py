@@ -0,0 +1,199 @@
+# stdlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar("gort_trace", default=None)
+
+
+class Trace:
+    def __init__(self, name):
+        """
+        The spans recorded for one job, in Chrome trace-event format.
+
+        Load the written file in chrome://tracing or https://ui.perfetto.dev.
+        Spans nest by time within each thread's row.
+
+        Args:
+            name (str): What the trace is for, shown as the process name.
+        """
+        self.name = name
+        self.events = []
+        self.threads = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, start, end, args):
+        tid = threading.get_ident()
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": int(start * 1e6),
+            "dur": int((end - start) * 1e6),
+            "pid": 1,
+            "tid": tid,
+            "args": args,
+        }
+        with self.lock:
+            self.events.append(event)
+            self.threads.setdefault(tid, threading.current_thread().name)
+
+    def to_json(self):
+        with self.lock:
+            meta = [
+                {
+                    "name": "process_name",
+                    "ph": "M",
+                    "pid": 1,
+                    "args": {"name": self.name},
+                }
+            ]
+            for tid, thread_name in self.threads.items():
+                meta.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": 1,
+                        "tid": tid,
+                        "args": {"name": thread_name},
+                    }
+                )
+            return {"traceEvents": meta + sorted(self.events, key=lambda e: e["ts"])}
+
+
+@contextmanager
+def span(name, **args):
+    """
+    Records the enclosed block as a span in the current job's trace, if any.
+
+    Args:
+        name (str): The span name.
+        **args: Details to attach to the span, like the command or tool name.
+    """
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        trace.add(name, start, time.time(), args)
+
+
+def record(name, start, end, **args):
+    """
+    Records a span that has already happened, from wall-clock start and end times.
+    """
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, start, end, args)
+
+
+def traced(name):
+    """
+    Decorator that records each call as a span called name.
+    """
+
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def trace_client(name):
+    """
+    Class decorator that records every public method of an API client as a
+    "<name>.<method>" span. Generator methods (iter_*) are left alone.
+    """
+
+    def decorate(cls):
+        for attr, value in list(vars(cls).items()):
+            if attr.startswith("_") or attr.startswith("iter_") or not callable(value):
+                continue
+            setattr(cls, attr, traced(f"{name}.{attr}")(value))
+        return cls
+
+    return decorate
+
+
+def submit(pool, func, *args, **kwargs):
+    """
+    Submits func to an executor so its spans land in the caller's trace.
+    """
+    return pool.submit(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+class TraceStore:
+    def __init__(self, root, keep=10):
+        """
+        Writes finished traces to disk, grouped by issue.
+
+        Args:
+            root (str): The directory to write traces under.
+            keep (int): How many traces to keep per issue.
+        """
+        self.root = os.path.abspath(root)
+        self.keep = keep
+
+    def issue_dir(self, provider, owner, repo, issue_number):
+        parts = [provider, owner, repo, str(issue_number)]
+        for part in parts:
+            if part in ("", ".", "..") or "/" in part or "\\" in part:
+                raise ValueError(f"Bad trace path component: {part!r}")
+        return os.path.join(self.root, *parts)
+
+    @contextmanager
+    def job(self, provider, owner, repo, issue_number, delivery_id=None):
+        """
+        Collects a trace for the enclosed job and writes it out when the job ends,
+        even if it failed.
+
+        Yields:
+            Trace: The trace being recorded.
+        """
+        trace = Trace(f"{provider} {owner}/{repo}#{issue_number}")
+        token = _current.set(trace)
+        try:
+            yield trace
+        finally:
+            _current.reset(token)
+            self.write(trace, provider, owner, repo, issue_number, delivery_id)
+
+    def write(self, trace, provider, owner, repo, issue_number, delivery_id):
+        directory = self.issue_dir(provider, owner, repo, issue_number)
+        os.makedirs(directory, exist_ok=True)
+        delivery = (delivery_id or "nodelivery").replace("/", "_")
+        name = f"{time.time():.6f}-{delivery}.json"
+        with open(os.path.join(directory, name), "w") as f:
+            json.dump(trace.to_json(), f)
+
+        traces = sorted(os.listdir(directory))
+        for old in traces[: -self.keep]:
+            try:
+                os.remove(os.path.join(directory, old))
+            except OSError:
+                pass
+
+    def latest(self, provider, owner, repo, issue_number):
+        """
+        Returns:
+            dict or None: The most recent trace for the issue.
+        """
+        try:
+            directory = self.issue_dir(provider, owner, repo, issue_number)
+            traces = sorted(os.listdir(directory))
+        except (OSError, ValueError):
+            return None
+        if not traces:
+            return None
+        with open(os.path.join(directory, traces[-1])) as f:
+            return json.load(f)
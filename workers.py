@@ -0,0 +1,66 @@
+# stdlib
+import queue
+import threading
+import traceback
+
+
+class WorkerPool:
+    def __init__(self, size):
+        """
+        A fixed-size pool of background threads that run queued jobs.
+
+        Args:
+            size (int): The number of worker threads to start.
+        """
+        self.size = size
+        self.jobs = queue.Queue()
+        self.threads = []
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the worker threads. Safe to call more than once.
+        """
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.size):
+                t = threading.Thread(
+                    target=self._work, name=f"gort-worker-{i}", daemon=True
+                )
+                t.start()
+                self.threads.append(t)
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queues a job to be run by the next free worker.
+
+        Args:
+            func (callable): The function to run.
+            *args: Positional arguments for func.
+            **kwargs: Keyword arguments for func.
+        """
+        self.jobs.put((func, args, kwargs))
+
+    def queue_depth(self):
+        """
+        Returns:
+            int: The number of jobs waiting for a worker.
+        """
+        return self.jobs.qsize()
+
+    def _work(self):
+        while True:
+            func, args, kwargs = self.jobs.get()
+            with self.lock:
+                self.in_flight += 1
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                print("Job failed:")
+                traceback.print_exc()
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+                self.jobs.task_done()
@@ -0,0 +1,537 @@
+# stdlib
+import fcntl
+import os
+import re
+import shutil
+import subprocess
+import threading
+import uuid
+from contextlib import contextmanager
+
+# local
+import metrics
+import tracing
+
+CLONE_STRATEGIES = ("full", "shallow", "partial", "sparse")
+
+# Words in issue text that look like paths: src/utils/, docs/api.md, setup.py
+PATH_PATTERN = re.compile(
+    r"(?<![\w/.:-])(?:\./)?"
+    r"((?:[\w.-]+/)+(?:[\w.-]+)?|[\w-]+\.[A-Za-z]\w{0,7})"
+    r"(?![\w/])"
+)
+
+
+def mentioned_paths(texts):
+    """
+    Returns:
+        list: The path-like words in texts, in order of first mention.
+    """
+    found = {}
+    for text in texts:
+        for match in PATH_PATTERN.finditer(text or ""):
+            found.setdefault(match.group(1).rstrip("/"), None)
+    return [path for path in found if path]
+
+
+def dir_size(path):
+    """
+    Returns:
+        int: The total size in bytes of all files under path.
+    """
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class ToolCache:
+    def __init__(self):
+        """
+        Remembers the results of read-only tool calls within one job.
+
+        Results are keyed by the command and a generation counter for the
+        worktree. Anything that may change the files bumps the generation, which
+        makes every earlier result stale.
+        """
+        self.generation = 0
+        self.results = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, command):
+        with self.lock:
+            result = self.results.get((self.generation, command))
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        metrics.TOOL_CACHE.labels("miss" if result is None else "hit").inc()
+        return result
+
+    def put(self, command, result):
+        with self.lock:
+            self.results[(self.generation, command)] = result
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.results.clear()
+
+
+class Workspace:
+    def __init__(self, path, branch, sparse_dirs=None):
+        """
+        A job's checkout.
+
+        Args:
+            path (str): The worktree directory.
+            branch (str): The branch on the fork that the job pushes to.
+            sparse_dirs (list, optional): The directories checked out, if the
+                worktree is sparse. Files at the top level are always there.
+        """
+        self.path = path
+        self.branch = branch
+        self.sparse_dirs = sparse_dirs
+        self.tool_cache = ToolCache()
+
+
+class MirrorLock:
+    def __init__(self, path):
+        """
+        Guards one mirror between threads and between gort processes that share
+        workspace_dir, with flock on files next to path.
+
+        Holding the lock serializes git operations on the mirror. Separately,
+        every job with a worktree of the mirror holds a shared lock (see use),
+        so no process evicts a mirror another one is working in.
+
+        Args:
+            path (str): Where to put the lock files, without an extension.
+        """
+        self.path = path
+        self.thread_lock = threading.Lock()
+        self.file = None
+
+    def acquire(self, blocking=True):
+        if not self.thread_lock.acquire(blocking):
+            return False
+        f = open(f"{self.path}.lock", "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            f.close()
+            self.thread_lock.release()
+            return False
+        self.file = f
+        return True
+
+    def release(self):
+        f, self.file = self.file, None
+        f.close()
+        self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def use(self):
+        """
+        Marks the mirror as used by a job until the returned file is closed.
+        """
+        f = open(f"{self.path}.inuse", "a")
+        fcntl.flock(f, fcntl.LOCK_SH)
+        return f
+
+    def in_use(self):
+        """
+        Returns:
+            bool: True if a job in any process has a worktree of the mirror.
+        """
+        with open(f"{self.path}.inuse", "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+        return False
+
+
+class WorkspaceManager:
+    def __init__(self, config):
+        """
+        Keeps one bare mirror per repository and hands out a git worktree per job.
+
+        Mirrors live under <workspace_dir>/mirrors and are refreshed with git fetch.
+        When they use more than workspace_budget_mb, the least recently used mirrors
+        that no job is using are deleted.
+
+        How a mirror is cloned depends on its strategy (see choose_strategy):
+        "full" clones all history, "shallow" only the last clone_depth commits,
+        "partial" all commits but no file contents until a checkout needs them,
+        and "sparse" is a partial clone whose worktrees only check out the
+        directories the issue mentions.
+        """
+        self.root = os.path.abspath(config.get("workspace_dir", "workspaces"))
+        self.mirrors_dir = os.path.join(self.root, "mirrors")
+        self.jobs_dir = os.path.join(self.root, "jobs")
+        self.locks_dir = os.path.join(self.root, "locks")
+        self.budget = config.get("workspace_budget_mb", 20480) * 1024 * 1024
+        self.lock = threading.Lock()
+        self.mirror_locks = {}
+        self.active = {}
+        self.strategy = config.get("clone_strategy", "auto")
+        self.repo_strategies = config.get("clone_strategies", {})
+        self.depth = config.get("clone_depth", 50)
+        self.partial_kb = config.get("partial_clone_mb", 500) * 1024
+        for strategy in [self.strategy, *self.repo_strategies.values()]:
+            if strategy != "auto" and strategy not in CLONE_STRATEGIES:
+                raise ValueError(f"Unknown clone strategy: {strategy}")
+        os.makedirs(self.mirrors_dir, exist_ok=True)
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        os.makedirs(self.locks_dir, exist_ok=True)
+
+    def git(self, *args, cwd=None):
+        result = subprocess.run(
+            ["git", *args], cwd=cwd, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            raise RuntimeError(
+                f"git {' '.join(args)} failed: {result.stderr.strip()}"
+            )
+        return result.stdout.strip()
+
+    def mirror_path(self, owner, repo):
+        return os.path.join(self.mirrors_dir, owner, f"{repo}.git")
+
+    def mirror_lock(self, mirror):
+        with self.lock:
+            if mirror not in self.mirror_locks:
+                # Owner names can't contain "@", so this can't collide
+                name = os.path.relpath(mirror, self.mirrors_dir).replace(os.sep, "@")
+                self.mirror_locks[mirror] = MirrorLock(
+                    os.path.join(self.locks_dir, name)
+                )
+            return self.mirror_locks[mirror]
+
+    def choose_strategy(self, repo_slug, size_kb=None, paths=None):
+        """
+        Picks how to clone a repo for a job.
+
+        A repo listed in clone_strategies uses that strategy, and otherwise
+        clone_strategy applies. With "auto", repos under partial_clone_mb are
+        cloned in full; bigger ones get a partial clone, made sparse when the
+        issue mentions paths.
+
+        Args:
+            repo_slug (str): The repo as owner/name.
+            size_kb (int, optional): The repo's size, as the API reports it.
+            paths (list, optional): Paths mentioned in the issue.
+
+        Returns:
+            str: One of CLONE_STRATEGIES.
+        """
+        name = repo_slug.split("/")[-1]
+        strategy = self.repo_strategies.get(
+            repo_slug, self.repo_strategies.get(name, self.strategy)
+        )
+        if strategy != "auto":
+            return strategy
+        if not size_kb or size_kb < self.partial_kb:
+            return "full"
+        return "sparse" if paths else "partial"
+
+    def mirror_kind(self, mirror):
+        try:
+            return self.git("config", "--get", "gort.clonekind", cwd=mirror)
+        except RuntimeError:
+            # Mirrors from before clone strategies are full clones
+            return "full"
+
+    def refresh_mirror(self, url, owner, repo, strategy="full"):
+        """
+        Clones a bare mirror of url, or fetches into it if it already exists.
+
+        A shallow mirror stays shallow, unless a full clone is asked for, in which
+        case the rest of its history is fetched. Partial mirrors stay partial,
+        since blobs they're missing are fetched when needed.
+
+        Returns:
+            str: The path to the mirror.
+        """
+        mirror = self.mirror_path(owner, repo)
+        kind = "partial" if strategy == "sparse" else strategy
+        if os.path.exists(mirror):
+            print(f"Fetching {owner}/{repo}")
+            args = ["fetch", "origin", "--prune"]
+            current = self.mirror_kind(mirror)
+            if current == "shallow" and kind == "full":
+                args.append("--unshallow")
+            elif current == "shallow":
+                args += ["--depth", str(self.depth)]
+            with metrics.WORKSPACE_SECONDS.labels("fetch").time(), tracing.span(
+                "workspace.fetch", repo=f"{owner}/{repo}"
+            ):
+                self.git(*args, cwd=mirror)
+            if "--unshallow" in args:
+                self.git("config", "gort.clonekind", "full", cwd=mirror)
+        else:
+            print(f"Cloning {kind} mirror of {owner}/{repo}")
+            print(f"Target URL: {url}")
+            os.makedirs(os.path.dirname(mirror), exist_ok=True)
+            clone_args = {
+                "full": [],
+                # A shallow clone only gets the default branch unless told otherwise
+                "shallow": ["--depth", str(self.depth), "--no-single-branch"],
+                "partial": ["--filter=blob:none"],
+            }[kind]
+            fetch_args = ["--depth", str(self.depth)] if kind == "shallow" else []
+            with metrics.WORKSPACE_SECONDS.labels("clone").time(), tracing.span(
+                "workspace.clone", repo=f"{owner}/{repo}", strategy=kind
+            ):
+                self.git("clone", "--bare", *clone_args, url, mirror)
+                self.git(
+                    "config",
+                    "remote.origin.fetch",
+                    "+refs/heads/*:refs/remotes/origin/*",
+                    cwd=mirror,
+                )
+                self.git("config", "gort.clonekind", kind, cwd=mirror)
+                self.git("fetch", "origin", *fetch_args, cwd=mirror)
+        # mtime on the mirror directory doubles as its last-used time
+        os.utime(mirror)
+        return mirror
+
+    def default_branch(self, mirror):
+        return self.git("symbolic-ref", "--short", "HEAD", cwd=mirror)
+
+    def remote_branch_exists(self, mirror, branch):
+        try:
+            self.git("rev-parse", "--verify", f"refs/remotes/origin/{branch}", cwd=mirror)
+            return True
+        except RuntimeError:
+            return False
+
+    def sparse_dirs(self, mirror, ref, paths):
+        """
+        Matches paths mentioned in an issue against the files at ref.
+
+        A file counts by its directory, and a bare file name matches files with
+        that name anywhere, if there are only a few.
+
+        Returns:
+            list or None: The directories to check out, or None if no path
+            matched and the whole tree should be checked out.
+        """
+        files = self.git("ls-tree", "-r", "--name-only", ref, cwd=mirror).splitlines()
+        dirs = {os.path.dirname(f) for f in files}
+        for d in list(dirs):
+            while d:
+                d = os.path.dirname(d)
+                dirs.add(d)
+        by_name = {}
+        for f in files:
+            by_name.setdefault(os.path.basename(f), []).append(f)
+
+        matched = False
+        wanted = set()
+        for path in paths:
+            if path in dirs:
+                matched = True
+                wanted.add(path)
+                continue
+            candidates = []
+            if path in by_name.get(os.path.basename(path), []):
+                candidates = [path]
+            if not candidates and "/" not in path:
+                candidates = by_name.get(path, [])[:5]
+            for f in candidates:
+                matched = True
+                wanted.add(os.path.dirname(f))
+        if not matched:
+            return None
+        # Top-level files are always checked out, so "" needs no entry
+        return sorted(d for d in wanted if d)
+
+    @contextmanager
+    def checkout(
+        self,
+        url,
+        owner,
+        repo,
+        job_id=None,
+        branch=None,
+        strategy="full",
+        paths=None,
+        resume=False,
+    ):
+        """
+        Yields a Workspace with a fresh worktree of owner/repo for one job.
+
+        Every job gets its own directory and local branch, named after job_id, so
+        jobs on the same repo never share files. If branch already exists on the
+        remote, the worktree starts from it, so follow-up jobs continue earlier
+        work; otherwise it starts from the default branch. The worktree is
+        removed when the block exits.
+
+        Args:
+            url (str): The URL to clone the mirror from.
+            owner (str): The owner of the repository.
+            repo (str): The name of the repository.
+            job_id (str, optional): A unique name for the job, such as the issue
+                number and webhook delivery id. Random if not given.
+            branch (str, optional): The branch the job pushes to. Defaults to the
+                default branch.
+            strategy (str): How to clone the repo; see choose_strategy.
+            paths (list, optional): Paths mentioned in the issue, for a sparse
+                checkout.
+            resume (bool): Pick up the worktree job_id left behind when the
+                process running it died, with whatever edits it had made,
+                instead of checking out a new one. See has_worktree.
+        """
+        mirror = self.mirror_path(owner, repo)
+        job = job_id or uuid.uuid4().hex[:12]
+        path = os.path.join(self.jobs_dir, f"{repo}-{job}")
+        resume = resume and self.has_worktree(owner, repo, job)
+        if os.path.exists(path) and not resume:
+            job = f"{job}-{uuid.uuid4().hex[:6]}"
+            path = os.path.join(self.jobs_dir, f"{repo}-{job}")
+        local_branch = f"gort-job-{job}"
+
+        with self.lock:
+            self.active[mirror] = self.active.get(mirror, 0) + 1
+        in_use = self.mirror_lock(mirror).use()
+        try:
+            if resume:
+                print("Reusing workspace", path)
+                if branch is None:
+                    branch = self.default_branch(mirror)
+                sparse = self.worktree_sparse_dirs(path)
+                yield Workspace(path, branch, sparse_dirs=sparse)
+                return
+            with self.mirror_lock(mirror):
+                self.refresh_mirror(url, owner, repo, strategy)
+                if branch is None:
+                    branch = self.default_branch(mirror)
+                base = branch
+                if not self.remote_branch_exists(mirror, base):
+                    base = self.default_branch(mirror)
+                sparse = None
+                if strategy == "sparse" and paths:
+                    sparse = self.sparse_dirs(mirror, f"origin/{base}", paths)
+                with metrics.WORKSPACE_SECONDS.labels(
+                    "worktree"
+                ).time(), tracing.span("workspace.worktree", repo=f"{owner}/{repo}"):
+                    self.git(
+                        "worktree",
+                        "add",
+                        *(["--no-checkout"] if sparse is not None else []),
+                        "-B",
+                        local_branch,
+                        path,
+                        f"origin/{base}",
+                        cwd=mirror,
+                    )
+                    if sparse is not None:
+                        print(f"Sparse checkout of {owner}/{repo}:", sparse or "top level")
+                        self.git("sparse-checkout", "set", "--cone", *sparse, cwd=path)
+                        # Fill the still empty index, writing only the sparse dirs
+                        self.git("checkout", "-q", cwd=path)
+            yield Workspace(path, branch, sparse_dirs=sparse)
+        finally:
+            with self.mirror_lock(mirror):
+                self.remove_worktree(mirror, path, local_branch)
+            in_use.close()
+            with self.lock:
+                self.active[mirror] -= 1
+            self.evict()
+
+    def remove_worktree(self, mirror, path, local_branch):
+        if os.path.exists(mirror):
+            try:
+                self.git("worktree", "remove", "--force", path, cwd=mirror)
+                self.git("branch", "-D", local_branch, cwd=mirror)
+            except RuntimeError as e:
+                print("Failed to clean up worktree:", e)
+        shutil.rmtree(path, ignore_errors=True)
+        if os.path.exists(mirror):
+            self.git("worktree", "prune", cwd=mirror)
+
+    def has_worktree(self, owner, repo, job_id):
+        """
+        Returns:
+            bool: Whether the worktree of job_id is still there, along with the
+            mirror it belongs to.
+        """
+        path = os.path.join(self.jobs_dir, f"{repo}-{job_id}")
+        mirror = self.mirror_path(owner, repo)
+        if not os.path.exists(path) or not os.path.exists(mirror):
+            return False
+        try:
+            self.git("rev-parse", "--git-dir", cwd=path)
+        except RuntimeError:
+            return False
+        return True
+
+    def worktree_sparse_dirs(self, path):
+        """
+        Returns:
+            list or None: The directories checked out in a sparse worktree, or
+            None if it isn't sparse.
+        """
+        try:
+            return self.git("sparse-checkout", "list", cwd=path).split()
+        except RuntimeError:
+            return None
+
+    def discard(self, owner, repo, job_id):
+        """
+        Removes the worktree a job left behind when the process running it died,
+        so the job can check out again under the same name.
+        """
+        path = os.path.join(self.jobs_dir, f"{repo}-{job_id}")
+        if not os.path.exists(path):
+            return
+        print("Removing leftover workspace", path)
+        mirror = self.mirror_path(owner, repo)
+        with self.mirror_lock(mirror):
+            self.remove_worktree(mirror, path, f"gort-job-{job_id}")
+
+    def evict(self):
+        """
+        Deletes cold mirrors, least recently used first, until the cache fits
+        in the disk budget. Mirrors that a job is using are never deleted.
+        """
+        mirrors = []
+        for owner in os.listdir(self.mirrors_dir):
+            owner_dir = os.path.join(self.mirrors_dir, owner)
+            for name in os.listdir(owner_dir):
+                path = os.path.join(owner_dir, name)
+                mirrors.append((os.stat(path).st_mtime, path, dir_size(path)))
+
+        total = sum(size for _, _, size in mirrors)
+        for _, path, size in sorted(mirrors):
+            if total <= self.budget:
+                break
+            with self.lock:
+                if self.active.get(path, 0) > 0:
+                    continue
+            lock = self.mirror_lock(path)
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                # Another process may have a job in it
+                if lock.in_use():
+                    continue
+                print(f"Evicting cold mirror {path}")
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+            finally:
+                lock.release()